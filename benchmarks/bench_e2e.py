@@ -0,0 +1,489 @@
+"""
+Offline end-to-end benchmark of engine.workflow, analyze_nutrient and
+get_exercise_summary. Every external dependency is replaced in process:
+
+- the LLM, agents and router by a streaming fake with configurable latency,
+- the Bloom profile/glucose API and the embedding API by httpx.MockTransport apps,
+- Redis by fakeredis (or a small in-memory stand-in when it is not installed),
+- database calls by a fake that answers on the database worker threads after
+  --db-latency seconds; pass --real-db to use the database configured in .env.
+
+N sessions run concurrently, each sending --turns chat turns round-robin over
+the intents. The report gives p50/p95/p99 latency, time to first chunk and
+throughput per intent.
+
+    python benchmarks/bench_e2e.py --sessions 50 --turns 6 --first-token 0.3
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import httpx
+import orjson as json
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+
+os.environ.setdefault("LOG_DIR", os.path.join(tempfile.gettempdir(), "emma-bench"))
+os.environ.setdefault("MODEL", "fake-llm")
+
+# (intent, question) pairs sent by every session in turn
+TURNS = [
+    ("dietary", "帮我制定一周的孕期饮食计划"),
+    ("nutrition", "孕期吃香蕉的热量和营养怎么样"),
+    ("nutrition_en", "How many calories and how much protein does a banana have?"),
+    ("health", "怀孕28周经常头晕是什么症状"),
+    ("exercise", "孕期每天散步多久合适，可以做瑜伽吗"),
+    ("chat", "最近心情不好，总是很焦虑"),
+    ("llm_router", "你好呀，今天过得怎么样"),
+]
+# what the LLM router answers for every turn; local keyword rules are off by default
+ROUTER_CHOICES = {
+    "dietary": 1,
+    "nutrition": 2,
+    "nutrition_en": 2,
+    "health": 3,
+    "exercise": 4,
+    "chat": 5,
+    "llm_router": 5,
+}
+
+ANSWER = (
+    "孕期饮食要注意均衡，每天保证足够的蛋白质、蔬菜和水果。\n"
+    "香蕉含有丰富的钾和膳食纤维，一根中等大小的香蕉大约有一百大卡热量。\n"
+    "如果有妊娠期糖尿病，建议分次少量食用，并搭配坚果或酸奶一起吃。\n\n"
+    "记得定期监测血糖，有任何不适及时联系医生。"
+)
+JSON_PROMPTS = {"emma_nutrition", "emma_future", "emma_fitness"}
+
+
+class Settings:
+    first_token = 0.3
+    token_delay = 0.01
+    api_latency = 0.02
+    db_latency = 0.002
+
+
+# ---------------------------------------------------------------- fake LLM
+
+
+def make_chunk(content: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        id="chatcmpl-bench",
+        object="chat.completion.chunk",
+        choices=[
+            SimpleNamespace(
+                index=0,
+                delta=SimpleNamespace(role="assistant", content=content),
+                message=None,
+                finish_reason=None,
+            )
+        ],
+    )
+
+
+async def stream_text(text: str, piece: int = 3):
+    await asyncio.sleep(Settings.first_token)
+    for i in range(0, len(text), piece):
+        if i:
+            await asyncio.sleep(Settings.token_delay)
+        yield make_chunk(text[i : i + piece])
+
+
+async def complete_text(text: str) -> str:
+    await asyncio.sleep(Settings.first_token + Settings.token_delay * len(text) / 3)
+    return text
+
+
+def answer_for(prompt_func) -> str:
+    name = getattr(prompt_func, "__name__", "")
+    if name in JSON_PROMPTS:
+        return "```json\n" + json.dumps({"message": ANSWER}).decode() + "\n```"
+    return ANSWER
+
+
+class AgentConfig:
+    def __init__(self, user_id=None, session_id=None, **kwargs):
+        self.user_id = user_id
+        self.session_id = session_id
+
+
+class ChatAgent:
+    def __init__(self, config: AgentConfig):
+        self.config = config
+
+    def act(self, question, _round, _mode, prompt_func, context=None, stream=False):
+        return stream_text(answer_for(prompt_func))
+
+
+class NullAgent(ChatAgent):
+    async def act(self, question, message):
+        yield make_chunk(message)
+
+
+class RouterOptions:
+    def __init__(self, options: List[str]):
+        self.options = options
+
+
+class UserIntentionRouter:
+    def __init__(self, model, options, config, description):
+        self.model = model
+
+    async def classify(self, question: str) -> Dict[str, Any]:
+        await complete_text("{}")
+        for intent, text in TURNS:
+            if text == question:
+                return {"choice": ROUTER_CHOICES.get(intent, 5)}
+        return {"choice": 5}
+
+
+async def fake_llm(prompt, model=None, stream=False, is_text=False, **kwargs):
+    """Stands in for both capybara.llm.llm and the engine's llm"""
+    text = json.dumps(prompt).decode() if not isinstance(prompt, str) else prompt
+    if stream:
+        return stream_text(ANSWER)
+    if "USDA" in text:
+        return await complete_text(
+            json.dumps(
+                {
+                    "items": [
+                        {
+                            "name": "香蕉",
+                            "macro": {
+                                "calories": 105,
+                                "protein": 1.3,
+                                "fat": 0.4,
+                                "carb": 27,
+                            },
+                        }
+                    ]
+                }
+            ).decode()
+        )
+    if "exercise" in text:
+        return await complete_text(
+            json.dumps(
+                {"summary": "运动量适中", "advice": "注意补水", "calories": 120}
+            ).decode()
+        )
+    return await complete_text(ANSWER)
+
+
+def install_fake_modules() -> None:
+    """Modules the engine imports that are not part of this repository"""
+
+    def module(name: str, **attrs) -> types.ModuleType:
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    module("capybara").llm = module("capybara.llm", llm=fake_llm)
+    module("llm", llm=fake_llm)
+    module("agent").agent = module(
+        "agent.agent", AgentConfig=AgentConfig, ChatAgent=ChatAgent, NullAgent=NullAgent
+    )
+    module(
+        "router", RouterOptions=RouterOptions, UserIntentionRouter=UserIntentionRouter
+    )
+
+
+# ---------------------------------------------------------------- fake services
+
+PROFILE = {
+    "user_id": 1,
+    "age": 31,
+    "pre_weight": 58.0,
+    "cur_weight": 64.5,
+    "height": 1.65,
+    "is_twins": False,
+    "is_twin": False,
+    "glu": 5.6,
+    "hba1c": 5.4,
+    "bph": 118,
+    "bpl": 76,
+    "ga": 28,
+    "condition": "GDM",
+    "cond_level": 1,
+    "complications": "none",
+    "execise": 2,
+}
+GLUCOSE = [
+    {"time": f"2024-06-0{day} 0{hour}:00:00", "value": 5.1 + hour / 10}
+    for day in range(1, 8)
+    for hour in (7, 9)
+]
+
+
+async def bloom_app(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(Settings.api_latency)
+    if request.url.path.startswith("/api/v1/profile/user/"):
+        return httpx.Response(200, json=PROFILE)
+    if request.url.path.startswith("/api/v1/glucose/user/"):
+        return httpx.Response(200, json=GLUCOSE)
+    return httpx.Response(404)
+
+
+async def embedding_app(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(Settings.api_latency)
+    body = json.loads(request.content)
+    dim = body.get("dimensions", 1792)
+    data = [
+        {"index": i, "embedding": [((hash(text) >> k) % 7) / 7.0 for k in range(dim)]}
+        for i, text in enumerate(body["input"])
+    ]
+    return httpx.Response(200, json={"data": data})
+
+
+class InMemoryRedis:
+    """The subset of redis.asyncio used by the engine, when fakeredis is missing"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction: bool = True) -> "InMemoryPipeline":
+        return InMemoryPipeline(self)
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value):
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+
+    async def incrby(self, key, amount: int) -> int:
+        value = int(self.data.get(key, 0)) + amount
+        self.data[key] = str(value).encode()
+        return value
+
+    async def aclose(self):
+        pass
+
+
+class InMemoryPipeline:
+    def __init__(self, client: InMemoryRedis):
+        self.client = client
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def get(self, key):
+        self.calls.append(("get", key))
+
+    def incrby(self, key, amount: int):
+        self.calls.append(("incrby", key, amount))
+
+    async def execute(self):
+        results = [await getattr(self.client, op)(*args) for op, *args in self.calls]
+        self.calls = []
+        return results
+
+
+def redis_stand_in():
+    try:
+        import fakeredis
+
+        return fakeredis.FakeAsyncRedis()
+    except ImportError:
+        return InMemoryRedis()
+
+
+def fake_db_calls(nutrient) -> Dict[str, Any]:
+    """Answers of the database calls made through run_db, by function name"""
+    today = datetime.datetime.now()
+    rollups = [
+        (today - datetime.timedelta(days=d), 1850.0, 70.0, 60.0, 230.0)
+        + (400.0, 85.0, 10.0, 1000.0, 27.0, 11.0, 220.0)
+        for d in range(7, 0, -1)
+    ]
+    return {
+        "lookup_answer": lambda *a, **k: None,
+        "store_answer": lambda *a, **k: None,
+        # every session starts without history
+        "history_page": lambda *a, **k: [],
+        "get_or_none": lambda *a, **k: None,
+        "execute": lambda *a, **k: 1,
+        "calculate_nutrition_per_day": lambda *a, **k: (
+            nutrient.format_nutrition_per_day(rollups)
+        ),
+        "load_exercise_records": lambda *a, **k: (SimpleNamespace(calories=3.5), []),
+        "get_products": lambda *a, **k: "",
+    }
+
+
+def install_fake_db(aiodb, calls: Dict[str, Any]) -> None:
+    def run(func, *args, **kwargs):
+        time.sleep(Settings.db_latency)
+        target = getattr(func, "func", func)
+        name = getattr(target, "__name__", type(target).__name__)
+        if name not in calls:
+            raise RuntimeError(f"bench has no fake for database call {name}")
+        return calls[name](*args, **kwargs)
+
+    aiodb._run_with_connection = run
+
+
+# ---------------------------------------------------------------- driver
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Results:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.first_chunk = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name: str, start: float, first: float, end: float) -> None:
+        self.latency[name].append(end - start)
+        if first is not None:
+            self.first_chunk[name].append(first - start)
+
+    def report(self, elapsed: float) -> None:
+        print(
+            f"{'stage':17} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+            f" {'ttfc p50':>9} {'ttfc p95':>9} {'errors':>7}"
+        )
+        names = sorted(set(self.latency) | set(self.errors))
+        for name in names:
+            lat = self.latency[name]
+            ttfc = self.first_chunk[name]
+            print(
+                f"{name:17} {len(lat):5} {percentile(lat, 50) * 1000:8.1f}"
+                f" {percentile(lat, 95) * 1000:8.1f} {percentile(lat, 99) * 1000:8.1f}"
+                f" {percentile(ttfc, 50) * 1000:9.1f} {percentile(ttfc, 95) * 1000:9.1f}"
+                f" {self.errors[name]:7}"
+            )
+        total = sum(len(v) for v in self.latency.values())
+        print(f"{total} requests in {elapsed:.2f}s, {total / elapsed:.1f} requests/s")
+
+
+async def run_session(session: int, args, engine, nutrient, exercise, results):
+    user_id = f"bench-{session % args.users}"
+    config = {
+        "user_id": user_id,
+        "session_id": f"session-{session}",
+        "organization": "bench",
+        "is_thought": False,
+    }
+    for turn in range(args.turns):
+        intent, question = TURNS[(session + turn) % len(TURNS)]
+        start = time.perf_counter()
+        first = None
+        try:
+            async for chunk in engine.workflow(
+                engine.Query(role="user", content=question), dict(config), None
+            ):
+                if first is None:
+                    first = time.perf_counter()
+            results.add(intent, start, first, time.perf_counter())
+        except Exception as e:
+            results.errors[intent] += 1
+            if args.verbose:
+                print(f"{intent}: {type(e).__name__}: {e}")
+    if args.nutrient:
+        start = time.perf_counter()
+        try:
+            await nutrient.analyze_nutrient(user_id, "aGVsbG8=", 1, "")
+            results.add("analyze_nutrient", start, None, time.perf_counter())
+        except Exception as e:
+            results.errors["analyze_nutrient"] += 1
+            if args.verbose:
+                print(f"analyze_nutrient: {type(e).__name__}: {e}")
+    if args.exercise:
+        start = time.perf_counter()
+        try:
+            await exercise.get_exercise_summary(
+                user_id, "walking", "low", 30, 110, datetime.datetime.now(), ""
+            )
+            results.add("exercise_summary", start, None, time.perf_counter())
+        except Exception as e:
+            results.errors["exercise_summary"] += 1
+            if args.verbose:
+                print(f"exercise_summary: {type(e).__name__}: {e}")
+
+
+async def main(args) -> None:
+    Settings.first_token = args.first_token
+    Settings.token_delay = args.token_delay
+    Settings.api_latency = args.api_latency
+    Settings.db_latency = args.db_latency
+
+    install_fake_modules()
+    from emma.health import client, exercise, nutrient
+
+    sys.modules["nutrition"] = types.ModuleType("nutrition")
+    sys.modules["nutrition.emma"] = types.ModuleType("nutrition.emma")
+    sys.modules["nutrition.emma"].__dict__.update(
+        calculate_nutrition_per_day=nutrient.calculate_nutrition_per_day,
+        get_glu_summary=nutrient.get_glu_summary,
+        get_user_info=nutrient.get_user_info,
+        get_products=lambda: "",
+        get_user_preference_summary=lambda user_id: complete_text(
+            "User has no preferences"
+        ),
+    )
+    from emma import aiodb, embedding, engine, metrics, redisclient
+
+    client.set_bloom_client(
+        httpx.AsyncClient(
+            transport=httpx.MockTransport(bloom_app),
+            base_url="http://bloom.local/api/v1",
+        )
+    )
+    embedding._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(embedding_app), base_url="http://embed.local"
+    )
+    redis = redis_stand_in()
+    await redis.set("fp", "bench")
+    redisclient.set_redis_client(redis)
+    if not args.real_db:
+        install_fake_db(aiodb, fake_db_calls(nutrient))
+
+    results = Results()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_session(session, args, engine, nutrient, exercise, results)
+            for session in range(args.sessions)
+        )
+    )
+    results.report(time.perf_counter() - start)
+    if args.metrics:
+        print(metrics.render_metrics())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=len(TURNS))
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--first-token", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--no-nutrient", dest="nutrient", action="store_false")
+    parser.add_argument("--no-exercise", dest="exercise", action="store_false")
+    parser.add_argument("--real-db", action="store_true")
+    parser.add_argument("--metrics", action="store_true", help="print the histograms")
+    parser.add_argument("--verbose", action="store_true")
+    asyncio.run(main(parser.parse_args()))
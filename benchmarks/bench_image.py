@@ -0,0 +1,108 @@
+"""
+Benchmark of the meal photo preprocessing in emma/health/image.py: payload
+size, preprocessing time, peak Python heap and the resulting vision call
+latency, modelled as the upload of the data: URL at --bandwidth Mbit/s plus
+--model-latency seconds.
+
+    python benchmarks/bench_image.py --images ~/photos --bandwidth 20
+
+Without --images synthetic 4032x3024 phone-sized photos are used. Needs Pillow.
+"""
+
+import argparse
+import base64
+import io
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from emma.health.image import data_url, prepare_image  # noqa: E402
+
+
+def synthetic_photos(count: int) -> List[bytes]:
+    from PIL import Image, ImageFilter
+
+    photos = []
+    for seed in range(count):
+        rng = random.Random(seed)
+        noise = bytes(rng.randrange(256) for _ in range(160 * 120 * 3))
+        image = (
+            Image.frombytes("RGB", (160, 120), noise)
+            .resize((4032, 3024))
+            .filter(ImageFilter.GaussianBlur(3))
+        )
+        exif = image.getexif()
+        # phones store portrait shots sideways with an orientation tag
+        exif[0x0112] = 6 if seed % 2 else 1
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=92, exif=exif)
+        photos.append(output.getvalue())
+    return photos
+
+
+def load_photos(path: str) -> List[bytes]:
+    photos = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".heic", ".webp")):
+            with open(os.path.join(path, name), "rb") as f:
+                photos.append(f.read())
+    return photos
+
+
+def original_url(data: bytes) -> str:
+    """What analyze_nutrient sent before preprocessing"""
+    return f"data:image/jpeg;base64,{base64.b64encode(data).decode()}"
+
+
+def prepared_url(data: bytes) -> str:
+    return data_url(*prepare_image(data))
+
+
+def measure(name: str, build, photos: List[bytes], args) -> None:
+    sizes, times, peaks = [], [], []
+    for data in photos:
+        tracemalloc.start()
+        start = time.perf_counter()
+        url = build(data)
+        times.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        sizes.append(len(url))
+    upload = [size * 8 / (args.bandwidth * 1e6) for size in sizes]
+    vision = [t + u + args.model_latency for t, u in zip(times, upload)]
+    print(
+        f"{name:10} {statistics.mean(sizes) / 2**20:9.2f} MiB"
+        f" {statistics.mean(times) * 1000:9.1f} ms"
+        f" {statistics.mean(peaks) / 2**20:9.1f} MiB"
+        f" {statistics.mean(vision) * 1000:11.0f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default=None)
+    parser.add_argument("--count", type=int, default=6)
+    parser.add_argument("--bandwidth", type=float, default=20, help="Mbit/s upload")
+    parser.add_argument("--model-latency", type=float, default=1.5)
+    args = parser.parse_args()
+
+    photos = load_photos(args.images) if args.images else synthetic_photos(args.count)
+    print(
+        f"{len(photos)} photos, {statistics.mean(map(len, photos)) / 2**20:.2f} MiB"
+        " on average"
+    )
+    print(
+        f"{'':10} {'payload':>13} {'prepare':>12} {'peak heap':>13} {'vision call':>14}"
+    )
+    measure("original", original_url, photos, args)
+    measure("prepared", prepared_url, photos, args)
+
+
+if __name__ == "__main__":
+    main()
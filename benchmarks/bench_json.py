@@ -0,0 +1,112 @@
+"""
+Benchmark of extract_json_from_text: the original regex implementation against
+the single-pass scanner in emma/utils.py, over a corpus of LLM outputs.
+
+    python benchmarks/bench_json.py --corpus ~/logs/responses.jsonl --number 200
+
+The corpus is a directory of .txt files or a JSON-lines file whose records
+hold the raw model output in "content" or "text". Without --corpus a synthetic
+set of long answers (prose, fenced blocks, several objects) is used.
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+from typing import List
+
+import orjson as json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from emma.utils import extract_json_from_text  # noqa: E402
+
+
+def legacy_extract(text: str):
+    """The original regex-based implementation"""
+    json_match = re.search(r"```json\s*(.*?)\s*```", text, re.DOTALL)
+    if json_match:
+        json_str = json_match.group(1)
+    else:
+        json_match = re.search(r"\{.*\}", text, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(0)
+        else:
+            raise ValueError("No JSON found in response")
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to parse JSON: {str(e)}")
+
+
+def load_corpus(path: str) -> List[str]:
+    if os.path.isdir(path):
+        texts = []
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".txt"):
+                with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                    texts.append(f.read())
+        return texts
+    texts = []
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                texts.append(record.get("content") or record.get("text") or "")
+    return texts
+
+
+def synthetic_corpus() -> List[str]:
+    prose = "孕期饮食需要均衡，多吃蔬菜水果，注意补充叶酸和铁。{注意} " * 200
+    message = json.dumps({"message": prose, "items": [{"name": "苹果", "kcal": 52}]})
+    message = message.decode()
+    return [
+        message,
+        f"好的，以下是建议：\n```json\n{message}\n```\n希望对你有帮助。",
+        f"{prose}\n{message}\n{prose}",
+        f'{message}\n另外，参考数据：{{"choice": 2}} {prose}',
+        prose + " { 未闭合的括号 " + message,
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=None)
+    parser.add_argument("--number", type=int, default=100)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    total_chars = sum(len(text) for text in corpus)
+    print(f"{len(corpus)} responses, {total_chars / len(corpus):.0f} chars on average")
+
+    results = {}
+    for name, extract in (("legacy", legacy_extract), ("scanner", extract_json_from_text)):
+        parsed = []
+        for text in corpus:
+            try:
+                parsed.append(extract(text))
+            except ValueError:
+                parsed.append(None)
+
+        def run():
+            for text in corpus:
+                try:
+                    extract(text)
+                except ValueError:
+                    pass
+
+        seconds = timeit.timeit(run, number=args.number) / args.number
+        results[name] = parsed
+        failures = sum(result is None for result in parsed)
+        print(
+            f"{name:8} {seconds / len(corpus) * 1e6:10.1f} us/response "
+            f"{total_chars / seconds / 1e6:8.1f} Mchar/s {failures:5} failures"
+        )
+
+    differ = sum(a != b for a, b in zip(results["legacy"], results["scanner"]))
+    print(f"{differ} responses extract a different object")
+
+
+if __name__ == "__main__":
+    main()
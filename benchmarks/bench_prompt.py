@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of @prompt rendering: per-call compilation (the original
+decorator) against the cached template in emma/prompt.py.
+
+    python benchmarks/bench_prompt.py --number 2000
+"""
+
+import argparse
+import inspect
+import os
+import sys
+import timeit
+
+from jinja2 import Template
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from emma import prompt as prompts  # noqa: E402
+
+
+def legacy_render(func, *args, **kwargs):
+    """The original decorator body: signature and template rebuilt per call."""
+    signature = inspect.signature(func)
+    context = dict(zip(signature.parameters.keys(), args))
+    context.update(kwargs)
+    return Template(func.__doc__).render(context)
+
+
+def sample_args(param_names):
+    args = []
+    for name in param_names:
+        if name == "choices":
+            args.append(["dietary", "nutrition", "health", "exercise", "chat"])
+        elif name in ("guidelines", "exercise_bpm"):
+            args.append({"calories": 1800, "protein": 71, "min": 110, "max": 170})
+        elif name == "exercise":
+            args.append({"exercise": "walking", "intensity": "low", "duration": 30})
+        else:
+            args.append(f"sample {name}")
+    return args
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'prompt':32} {'legacy us':>10} {'cached us':>10} {'speedup':>8}")
+    for name, wrapper in inspect.getmembers(prompts, inspect.isfunction):
+        if not hasattr(wrapper, "template_name"):
+            continue
+        func = wrapper.__wrapped__
+        call_args = sample_args(wrapper.param_names)
+        try:
+            wrapper(*call_args)
+        except Exception as e:
+            print(f"{name:32} skipped: {type(e).__name__}: {e}")
+            continue
+        legacy = timeit.timeit(
+            lambda: legacy_render(func, *call_args), number=args.number
+        )
+        cached = timeit.timeit(lambda: wrapper(*call_args), number=args.number)
+        legacy_us = legacy / args.number * 1e6
+        cached_us = cached / args.number * 1e6
+        print(
+            f"{name:32} {legacy_us:10.1f} {cached_us:10.1f} {legacy_us / cached_us:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
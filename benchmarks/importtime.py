@@ -0,0 +1,130 @@
+"""
+Import-time profile of Emma modules from `python -X importtime`, with a budget.
+Each module is imported in a fresh interpreter; the report lists the slowest
+imports by cumulative time and the command exits with 1 when a module takes
+longer than --budget milliseconds, so it can run as a CI step.
+test/test_importtime.py checks the budgets of the modules that import here.
+
+    python benchmarks/importtime.py emma.health.nutrient emma.memory --budget 400
+    python benchmarks/importtime.py emma.engine --top 30 --raw importtime.txt
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import List, NamedTuple, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# "import time:      self [us] |  cumulative | imported package"
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+class Entry(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def profile(module: str) -> Tuple[List[Entry], str]:
+    """Import `module` in a new interpreter, returning its entries and any error"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT, env.get("PYTHONPATH", "")])
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    entries = []
+    errors = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append(
+                Entry(name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+            )
+        elif not line.startswith("import time:"):
+            errors.append(line)
+    return entries, "\n".join(errors) if proc.returncode else ""
+
+
+def subtree(module: str, entries: List[Entry]) -> List[Entry]:
+    """
+    The imports made by `import module`; the report lists children before their
+    parent, so these are the nested entries right before its top-level line.
+    Interpreter startup (site, .pth files) is left out.
+    """
+    end = max(
+        (i for i, e in enumerate(entries) if e.depth == 0 and e.module == module),
+        default=None,
+    )
+    if end is None:
+        return []
+    start = end
+    while start > 0 and entries[start - 1].depth > 0:
+        start -= 1
+    return entries[start : end + 1]
+
+
+def report(module: str, entries: List[Entry], top: int) -> int:
+    """Print the slowest imports of `module`, returning its total in microseconds"""
+    entries = subtree(module, entries)
+    total = entries[-1].cumulative_us if entries else 0
+    # top-level packages only, e.g. httpx rather than httpx._client
+    roots = {}
+    for entry in entries:
+        name = entry.module.split(".")[0]
+        if entry.module == name or name not in roots:
+            roots[name] = max(roots.get(name, 0), entry.cumulative_us)
+    print(f"{module}: {total / 1000:.1f} ms, {len(entries)} modules")
+    print(f"  {'package':32} {'cumulative':>12}")
+    for name, us in sorted(roots.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {name:32} {us / 1000:9.1f} ms")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=["emma.engine"])
+    parser.add_argument("--budget", type=float, default=None, help="ms per module")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--raw", default=None, help="write the raw report here")
+    parser.add_argument("--repeat", type=int, default=3, help="keep the fastest run")
+    args = parser.parse_args()
+
+    failed = False
+    raw = []
+    for module in args.modules:
+        # the first run also writes the bytecode caches
+        runs = [profile(module) for _ in range(max(args.repeat, 1))]
+        entries, error = min(
+            runs,
+            key=lambda run: sum(e.self_us for e in subtree(module, run[0]))
+            or float("inf"),
+        )
+        if error:
+            print(f"{module}: import failed\n{error}")
+            failed = True
+            continue
+        total = report(module, entries, args.top)
+        raw.extend(
+            f"{e.self_us:>10} | {e.cumulative_us:>10} | {'  ' * e.depth}{e.module}"
+            for e in subtree(module, entries)
+        )
+        if args.budget is not None and total > args.budget * 1000:
+            print(f"  over budget: {total / 1000:.1f} ms > {args.budget:.0f} ms")
+            failed = True
+    if args.raw:
+        with open(args.raw, "w") as f:
+            f.write("\n".join(raw) + "\n")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
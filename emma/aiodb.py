@@ -0,0 +1,41 @@
+"""
+Run synchronous peewee database work from async code without blocking the event loop.
+Calls are executed on a bounded pool of worker threads, each call checking a
+connection out of the shared pool and returning it when done.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+from .database import db
+from .settings import settings
+
+DB_EXECUTOR_WORKERS = settings.db_executor_workers
+
+_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="emma-db"
+)
+
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """Await `func(*args, **kwargs)` executed on a database worker thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(_run_with_connection, func, *args, **kwargs)
+    )
+
+
+def _run_with_connection(func: Callable, *args, **kwargs) -> Any:
+    with db.connection_context():
+        return func(*args, **kwargs)
+
+
+async def fetch_all(query) -> List[Any]:
+    """Execute a select query on a database worker and return all rows."""
+    return await run_db(list, query)
+
+
+def shutdown_db_executor(wait: bool = True) -> None:
+    _executor.shutdown(wait=wait)
@@ -0,0 +1,206 @@
+"""
+In-process caches shared by the Emma modules.
+"""
+
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire `ttl` seconds after being set.
+    Keeps hit / miss / eviction counters for monitoring.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """The value of a live entry, without counting a hit or miss or reordering"""
+        with self._lock:
+            item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return default
+        return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def keys(self) -> List[Hashable]:
+        """Snapshot of the keys that have not expired"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                key for key, (expires_at, _) in self._data.items() if expires_at >= now
+            ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def dhash(data: bytes, size: int = 8) -> Optional[int]:
+    """
+    Difference hash of an encoded image: size * size bits comparing neighbouring
+    pixels of a small grayscale thumbnail, stable under re-encoding and resizing.
+    None when Pillow is not installed or the data is not an image.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # decode JPEGs at a fraction of their size, the hash only needs 9x8 pixels
+            image.draft("L", (size * 8, size * 8))
+            image = ImageOps.exif_transpose(image)
+            pixels = image.convert("L").resize((size + 1, size)).tobytes()
+    except Exception:
+        return None
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+# dHashes with fewer set (or unset) bits are not used for near-duplicate matches
+MIN_HASH_BITS = 8
+
+
+class ImageResultCache:
+    """
+    Results computed from an image under some context (prompt inputs).
+    An exact hit needs the same bytes and context and is shared by everyone.
+    A near-duplicate hit needs an image whose dHash differs in at most
+    `max_distance` bits, under the same context and stored by the same owner,
+    e.g. a user's photo re-compressed or resized by the app. A similar photo
+    of another user may show different portions, so without an owner there are
+    no near-duplicate hits.
+    Values are stored as given, callers should not mutate them.
+    """
+
+    def __init__(self, maxsize: int = 2000, ttl: float = 86400, max_distance: int = 6):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.max_distance = max_distance
+        self.near_hits = 0
+        # (context, owner) -> {sha256: dhash}, pruned lazily when entries expire
+        self._hashes: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _distinctive(self, image_hash: Optional[int]) -> bool:
+        """Flat or plain gradient images hash to (almost) all 0 or 1 bits alike"""
+        if image_hash is None or self.max_distance <= 0:
+            return False
+        return MIN_HASH_BITS <= bin(image_hash).count("1") <= 64 - MIN_HASH_BITS
+
+    @staticmethod
+    def fingerprint(data: bytes) -> Tuple[str, Optional[int]]:
+        """(sha256, dhash) of the image, CPU bound: run it off the event loop"""
+        return hashlib.sha256(data).hexdigest(), dhash(data)
+
+    def get(
+        self,
+        fingerprint: Tuple[str, Optional[int]],
+        context: str,
+        owner: Optional[str] = None,
+    ) -> Any:
+        sha, image_hash = fingerprint
+        value = self.entries.get((context, sha))
+        if value is not None or owner is None or not self._distinctive(image_hash):
+            return value
+        with self._lock:
+            candidates = list(self._hashes.get((context, owner), {}).items())
+        for other, other_hash in candidates:
+            if bin(image_hash ^ other_hash).count("1") > self.max_distance:
+                continue
+            # candidates are not lookups of their own, keep them out of hits / misses
+            value = self.entries.peek((context, other))
+            if value is not None:
+                self.near_hits += 1
+                return value
+            with self._lock:
+                self._hashes.get((context, owner), {}).pop(other, None)
+        return None
+
+    def set(
+        self,
+        fingerprint: Tuple[str, Optional[int]],
+        context: str,
+        value: Any,
+        owner: Optional[str] = None,
+    ) -> None:
+        sha, image_hash = fingerprint
+        self.entries.set((context, sha), value)
+        if owner is None or not self._distinctive(image_hash):
+            return
+        with self._lock:
+            self._hashes.setdefault((context, owner), {})[sha] = image_hash
+            if (
+                sum(len(hashes) for hashes in self._hashes.values())
+                > 2 * self.entries.maxsize
+            ):
+                self._prune()
+
+    def _prune(self) -> None:
+        live = set(self.entries.keys())
+        for scope in list(self._hashes):
+            context, _ = scope
+            hashes = {
+                sha: h
+                for sha, h in self._hashes[scope].items()
+                if (context, sha) in live
+            }
+            if hashes:
+                self._hashes[scope] = hashes
+            else:
+                del self._hashes[scope]
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.entries.stats(), "near_hits": self.near_hits}
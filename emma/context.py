@@ -0,0 +1,68 @@
+"""
+Concurrent assembly of the prompt context for the chat workflow.
+"""
+
+import asyncio
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple, Union
+
+from .aiodb import run_db
+from .logger import log_perf, logger
+from .metrics import record
+
+# Seconds a single context source may take before its fallback is used
+DEFAULT_TIMEOUT = 8.0
+
+ContextSource = Union[Awaitable[Any], Callable[[], Any]]
+
+
+async def _fetch(source: ContextSource, timeout: float) -> Any:
+    if inspect.isawaitable(source):
+        return await asyncio.wait_for(source, timeout)
+    # plain callables are synchronous database reads, keep them off the loop
+    return await asyncio.wait_for(run_db(source), timeout)
+
+
+async def assemble_context(
+    sources: Dict[str, ContextSource],
+    fallbacks: Dict[str, Any] = None,
+    timeouts: Dict[str, float] = None,
+    default_timeout: float = DEFAULT_TIMEOUT,
+    request_id: str = None,
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Resolve all context sources concurrently.
+    A source that fails or exceeds its timeout is replaced by its fallback
+    (empty string by default), so one slow dependency never blocks the turn.
+    Returns the context and the elapsed seconds of every source.
+    """
+    start = time.perf_counter()
+    fallbacks = fallbacks or {}
+    timeouts = timeouts or {}
+    timings = {}
+
+    async def run(name: str, source: ContextSource) -> Any:
+        start = time.perf_counter()
+        try:
+            return await _fetch(source, timeouts.get(name, default_timeout))
+        except asyncio.TimeoutError:
+            logger.error(f"Context source {name} timed out")
+        except Exception as e:
+            logger.error(f"Context source {name} failed: {str(e)}")
+        finally:
+            timings[name] = time.perf_counter() - start
+        return fallbacks.get(name, "")
+
+    names = list(sources.keys())
+    values = await asyncio.gather(*(run(name, sources[name]) for name in names))
+    context = dict(zip(names, values))
+    for name in names:
+        record(f"context.{name}", timings[name])
+    log_perf(
+        "context",
+        time.perf_counter() - start,
+        request_id,
+        sources={name: round(timings[name] * 1000, 3) for name in names},
+    )
+    return context, timings
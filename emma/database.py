@@ -0,0 +1,120 @@
+"""
+The single pooled Postgres connection shared by every model in emma/db.py and
+emma/health/db.py.
+"""
+
+import threading
+import time
+from typing import Dict
+
+try:
+    from playhouse.postgres_ext import PooledPostgresqlExtDatabase
+except ImportError:  # peewee < 3.17
+    from playhouse.pool import PooledPostgresqlExtDatabase
+
+from .settings import settings
+
+DB_MAX_CONNECTIONS = settings.db_max_connections
+# Seconds a connection lives before it is recycled
+DB_STALE_TIMEOUT = settings.db_stale_timeout
+# Seconds to wait for a free connection when the pool is exhausted
+DB_POOL_TIMEOUT = settings.db_pool_timeout
+# Idle connections older than this are pinged before being handed out
+DB_HEALTH_CHECK_INTERVAL = settings.db_health_check_interval
+
+
+class HealthCheckedPooledDatabase(PooledPostgresqlExtDatabase):
+    """
+    Pool that drops connections failing a ping after sitting idle in the pool.
+    The ping runs inside the pool lock of peewee's _connect, so a slow round trip
+    delays every other checkout; only connections idle for longer than
+    health_check_interval pay for it.
+    """
+
+    def __init__(self, *args, health_check_interval: float = 30, **kwargs):
+        self.health_check_interval = health_check_interval
+        self.checkouts = 0
+        self.failed_health_checks = 0
+        self._released_at = {}
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        conn = super()._connect()
+        self.checkouts += 1
+        return conn
+
+    def _is_closed(self, conn):
+        # the pool discards closed connections without closing them
+        if super()._is_closed(conn):
+            self._close_raw(conn)
+            return True
+        released_at = self._released_at.pop(self.conn_key(conn), None)
+        if released_at and time.time() - released_at < self.health_check_interval:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return False
+        except Exception:
+            self.failed_health_checks += 1
+            self._close_raw(conn)
+            return True
+
+    def _close(self, conn, close_conn=False):
+        if not close_conn:
+            self._released_at[self.conn_key(conn)] = time.time()
+        super()._close(conn, close_conn)
+
+    def _close_raw(self, conn):
+        self._released_at.pop(self.conn_key(conn), None)
+        super()._close_raw(conn)
+
+    def pool_stats(self) -> Dict[str, int]:
+        with self._pool_lock:
+            return {
+                "max_connections": self._max_connections,
+                "in_use": len(self._in_use),
+                "idle": len(self._connections),
+                "checkouts": self.checkouts,
+                "failed_health_checks": self.failed_health_checks,
+            }
+
+
+db = HealthCheckedPooledDatabase(
+    settings.db_name,
+    user=settings.db_user,
+    password=settings.db_password,
+    host=settings.db_host,
+    port=settings.db_port,
+    max_connections=DB_MAX_CONNECTIONS,
+    stale_timeout=DB_STALE_TIMEOUT,
+    timeout=DB_POOL_TIMEOUT,
+    health_check_interval=DB_HEALTH_CHECK_INTERVAL,
+)
+
+
+class DatabaseConnectionMiddleware:
+    """
+    ASGI middleware scoping the event loop thread's connection to requests.
+    The connection is returned to the pool once no request is in flight;
+    work sent through aiodb.run_db checks out its own connection per call.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return await self.app(scope, receive, send)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                idle = self._in_flight == 0
+            if idle and not db.is_closed():
+                db.close()
@@ -1,21 +1,9 @@
 import datetime
 from peewee import *
-from playhouse.postgres_ext import PostgresqlExtDatabase, BinaryJSONField
+from playhouse.postgres_ext import BinaryJSONField
 from pgvector.peewee import VectorField
-import dotenv
-import os
-from utils import make_table_name
-
-dotenv.load_dotenv()
-
-
-db = PostgresqlExtDatabase(
-    os.getenv("DB_NAME"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-    host=os.getenv("DB_HOST", "localhost"),
-    port=os.getenv("DB_PORT", 19032)
-)
+from .database import db
+from .utils import make_table_name
 
 
 class BaseModel(Model):
@@ -135,11 +123,24 @@ class UserHistory(Model):
     class Meta:
         database = db
         table_function = make_table_name
+        # created_at, id: the recent turns of a session are read in index order,
+        # see history.py
         indexes = (
-            (('user_id', 'session_id', 'is_deleted'), False),
+            (('user_id', 'session_id', 'is_deleted', 'created_at', 'id'), False),
         )
         
         
+# Embedding tables by vector dimension
+VECTOR_TABLES = {
+    512: Vector512,
+    768: Vector768,
+    1024: Vector1024,
+    1536: Vector1536,
+    1792: Vector1792,
+    2048: Vector2048,
+}
+
+
 if __name__ == '__main__':
     db.connect()
     db.create_tables([Vector1536, Vector512, Vector1024, Vector2048, Vector768, Vector1792, MemoryModel, UserHistory])
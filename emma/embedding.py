@@ -0,0 +1,42 @@
+"""
+Text embeddings from an OpenAI compatible /embeddings endpoint.
+"""
+
+from typing import TYPE_CHECKING, List
+
+from .settings import settings
+
+if TYPE_CHECKING:
+    import httpx
+
+EMBEDDING_URL = settings.embedding_url
+EMBEDDING_KEY = settings.embedding_key
+EMBEDDING_MODEL = settings.embedding_model
+# emma_memory stores 1792-dim vectors
+EMBEDDING_DIM = settings.embedding_dim
+
+_client = None
+
+
+def _embedding_client() -> "httpx.AsyncClient":
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx
+
+        _client = httpx.AsyncClient(
+            base_url=EMBEDDING_URL,
+            headers={"Authorization": f"Bearer {EMBEDDING_KEY}"},
+            timeout=30,
+        )
+    return _client
+
+
+async def embed(texts: List[str], dimensions: int = EMBEDDING_DIM) -> List[List[float]]:
+    """Embed a batch of texts, returning the vectors in input order."""
+    response = await _embedding_client().post(
+        "/embeddings",
+        json={"model": EMBEDDING_MODEL, "input": texts, "dimensions": dimensions},
+    )
+    response.raise_for_status()
+    data = sorted(response.json()["data"], key=lambda item: item["index"])
+    return [item["embedding"] for item in data]
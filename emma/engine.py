@@ -1,19 +1,23 @@
-import os
-import sys
-
-sys.path.append(os.path.abspath(".."))
-
+import asyncio
+import copy
 import datetime
+import functools
+import os
 import time
 import uuid
 from typing import Any, AsyncGenerator, Dict
 
-import dotenv
-import redis
+import orjson as json
 from pydantic import BaseModel
 
 from agent.agent import AgentConfig, ChatAgent, NullAgent
 from llm import llm
+from .context import assemble_context
+from .eventid import event_ids
+from .intent import LocalIntentRouter
+from .logger import logger
+from .memory import semantic_cached
+from .metrics import record, timed_stream
 from nutrition.emma import (
     calculate_nutrition_per_day,
     get_glu_summary,
@@ -21,7 +25,7 @@ from nutrition.emma import (
     get_user_info,
     get_user_preference_summary,
 )
-from prompt import (
+from .prompt import (
     emma_chat,
     emma_fitness,
     emma_format_chat,
@@ -29,18 +33,27 @@ from prompt import (
     emma_nutrition,
 )
 from router import RouterOptions, UserIntentionRouter
-from utils import extract_json_from_text
+from .settings import settings
+from .utils import (
+    JsonFieldStreamer,
+    chunk_content,
+    detect_language,
+    set_chunk_content,
+)
 
-dotenv.load_dotenv()
-model = os.getenv("MODEL")
+model = settings.model
 
 
-# ONLY FOR TESTING. REMOVE IN PRODUCTION
+# ONLY FOR TESTING: "#test%" queries replay this file when ENABLE_TEST_QUERIES is set
 curr_path = os.path.dirname(os.path.abspath(__file__))
 root_path = os.path.dirname(curr_path)
 test_file = os.path.join(root_path, "test", "test_resp.txt")
-with open(test_file, "r") as f:
-    TEST_CONTENT = f.read()
+
+
+@functools.lru_cache(maxsize=1)
+def test_content() -> str:
+    with open(test_file, "r") as f:
+        return f.read()
 
 
 class Query(BaseModel):
@@ -65,16 +78,189 @@ user_intents = [
 
 
 options = RouterOptions(options=user_intents)
+local_router = LocalIntentRouter.from_env()
+
+# Used when a context source fails or times out, matching the values the
+# sources themselves return when their backend is unavailable
+CONTEXT_FALLBACKS = {
+    "userinfo": "暂无",
+    "food_preference": "User has no preferences",
+    "glu_summary": "",
+    "meal": "",
+    "products": "",
+}
+# Seconds per context source; the summaries include an LLM call of their own
+CONTEXT_TIMEOUTS = {
+    "userinfo": 3.0,
+    "food_preference": 15.0,
+    "glu_summary": 15.0,
+    "meal": 5.0,
+    "products": 3.0,
+}
+# Letters of the answer read before deciding whether it needs a rewrite
+LANGUAGE_SAMPLE = 48
+# A rewrite starts at the first line break after this many characters
+FORMAT_MIN_CHARS = settings.format_min_chars
+FORMAT_CONCURRENCY = settings.format_concurrency
+
+
+async def stream_json_field(
+    chunks: AsyncGenerator[Any, None], field: str = "message"
+) -> AsyncGenerator[Any, None]:
+    """
+    Stream the decoded `field` of a JSON answer as it is generated.
+    Chunks without text are passed through unchanged, except that finish chunks
+    are held back until the end: when the field never appears, the fallback
+    text still comes before them.
+    """
+    streamer = JsonFieldStreamer(field)
+    last = None
+    finished = []
+    parsing = 0.0
+    async for chunk in chunks:
+        content = chunk_content(chunk)
+        if not content:
+            if chunk.choices[0].finish_reason:
+                finished.append(chunk)
+            else:
+                yield chunk
+            continue
+        last = chunk
+        start = time.perf_counter()
+        piece = streamer.feed(content)
+        parsing += time.perf_counter() - start
+        if piece:
+            set_chunk_content(chunk, piece)
+            yield chunk
+    start = time.perf_counter()
+    tail = streamer.finish()
+    record("json_stream", parsing + time.perf_counter() - start)
+    if tail and last is not None:
+        # `last` may already be sent, the tail goes out in a chunk of its own
+        chunk = copy.deepcopy(last)
+        chunk.choices[0].finish_reason = None
+        set_chunk_content(chunk, tail)
+        yield chunk
+    for chunk in finished:
+        yield chunk
+
+
+async def rewrite_paragraphs(
+    question: str, chunks: AsyncGenerator[Any, None]
+) -> AsyncGenerator[Any, None]:
+    """
+    Rewrite a streamed answer with emma_format_chat one paragraph at a time.
+    A paragraph is sent as soon as it is complete, up to FORMAT_CONCURRENCY
+    rewrites run at once, and the rewrites are streamed back in order.
+    Only the text of the rewrites is forwarded; the answer ends with the finish
+    chunk of the original answer. Each rewrite sees its own paragraph only, so a
+    larger FORMAT_MIN_CHARS gives the model more context per rewrite.
+    The rewrites call the LLM directly rather than through an agent, one call
+    per paragraph, so they never add turns to the session history.
+    """
+    semaphore = asyncio.Semaphore(FORMAT_CONCURRENCY)
+    rewrites = asyncio.Queue()
+    tasks = []
+    final = None
+
+    async def rewrite(paragraph: str, out: asyncio.Queue):
+        try:
+            async with semaphore:
+                stream = await llm(
+                    emma_format_chat(question, paragraph), model=model, stream=True
+                )
+                async for chunk in timed_stream(stream, stage="format", model=model):
+                    # role and finish chunks of each rewrite would end the answer early
+                    if chunk_content(chunk):
+                        await out.put(chunk)
+        finally:
+            await out.put(None)
+
+    def start(paragraph: str, separator: str):
+        out = asyncio.Queue()
+        tasks.append(asyncio.create_task(rewrite(paragraph, out)))
+        rewrites.put_nowait((out, tasks[-1], separator))
+
+    async def split():
+        nonlocal final
+        text = ""
+        separator = ""
+        try:
+            async for chunk in chunks:
+                text += chunk_content(chunk)
+                if chunk.choices[0].finish_reason:
+                    final = chunk
+                if len(text) < FORMAT_MIN_CHARS:
+                    continue
+                cut = text.rfind("\n") + 1
+                if cut and text[:cut].strip():
+                    start(text[:cut], separator)
+                    separator = text[len(text[:cut].rstrip()) : cut]
+                    text = text[cut:]
+            if text.strip():
+                start(text, separator)
+        finally:
+            rewrites.put_nowait(None)
+
+    splitter = asyncio.create_task(split())
+    try:
+        while (item := await rewrites.get()) is not None:
+            out, task, separator = item
+            first = True
+            while (chunk := await out.get()) is not None:
+                if first and separator and chunk_content(chunk):
+                    set_chunk_content(chunk, separator + chunk_content(chunk))
+                    first = False
+                yield chunk
+            await task
+        await splitter
+        if final is not None:
+            # its text, if any, was part of the last paragraph
+            if chunk_content(final):
+                set_chunk_content(final, "")
+            yield final
+    finally:
+        for task in [splitter, *tasks]:
+            task.cancel()
+
+
+async def match_query_language(
+    question: str, chunks: AsyncGenerator[Any, None]
+) -> AsyncGenerator[Any, None]:
+    """
+    Pass a plain-text answer through when it is already in the language of the
+    question, otherwise rewrite it while it is still being generated.
+    """
+    target = detect_language(question)
+    buffered = []
+    sample = ""
+    async for chunk in chunks:
+        buffered.append(chunk)
+        sample += chunk_content(chunk)
+        if detect_language(sample, LANGUAGE_SAMPLE):
+            break
+
+    async def answer():
+        for chunk in buffered:
+            yield chunk
+        async for chunk in chunks:
+            yield chunk
+
+    if target is None or detect_language(sample) in (None, target):
+        async for chunk in answer():
+            yield chunk
+    else:
+        async for chunk in rewrite_paragraphs(question, answer()):
+            yield chunk
 
 
 async def workflow(
     query: Query, config: str, websocket
 ) -> AsyncGenerator[Dict[str, Any], None]:
     # TODO: event_id should be generated only for a new conversation
-    r = redis.Redis()
-    event_id = "chatcmpl-" + r.get("fp").decode() + "-" + str(r.incr("event_num"))
-    if "#test%" in query.content:
-        resp = await llm(TEST_CONTENT, model="qwen-max", stream=True)
+    event_id = await event_ids.next_id()
+    if settings.enable_test_queries and "#test%" in query.content:
+        resp = await llm(test_content(), model="qwen-max", stream=True)
         async for chunk in resp:
             yield chunk
         return
@@ -87,66 +273,94 @@ async def workflow(
         "我是健康助手，我可以帮助您制定饮食计划，回答关于食物和营养的问题，以及提供健康和营养相关的建议。",
     )
     question = query.content
-    choice = await router.classify(question)
-    print("choice:", choice)
+    start = time.perf_counter()
+    choice = await local_router.classify(question)
+    if choice is None:
+        choice = await router.classify(question)
+        local_router.remember(question, choice)
+        choice = {**choice, "source": "llm"}
+    logger.info(
+        "route "
+        + json.dumps(
+            {
+                "query": question,
+                "choice": choice.get("choice"),
+                "source": choice["source"],
+            }
+        ).decode()
+    )
+    record(
+        "route",
+        time.perf_counter() - start,
+        event_id,
+        choice=choice.get("choice"),
+        source=choice["source"],
+    )
     if choice.get("message"):
-        print("Others")
         agent = NullAgent(
             AgentConfig(user_id=config["user_id"], session_id=config["session_id"])
         )
         async for chunk in agent.act(question, choice["message"]):
             yield chunk
     elif int(choice.get("choice")) == 1:
-        print("dietary")
         emma_dietary_agent = ChatAgent(
             AgentConfig(user_id=config["user_id"], session_id=config["session_id"])
         )
-        context = {
-            "userinfo": await get_user_info(config["user_id"], is_formated=True),
-            "food_preference": await get_user_preference_summary(config["user_id"]),
-            "glu_summary": await get_glu_summary(config["user_id"]),
-            "products": get_products(),
-        }
-        async for chunk in emma_dietary_agent.act(
-            question, 0, "default", emma_nutrition, context, stream=False
+        context, _ = await assemble_context(
+            {
+                "userinfo": get_user_info(config["user_id"], is_formated=True),
+                "food_preference": get_user_preference_summary(config["user_id"]),
+                "glu_summary": get_glu_summary(config["user_id"]),
+                "products": get_products,
+            },
+            fallbacks=CONTEXT_FALLBACKS,
+            timeouts=CONTEXT_TIMEOUTS,
+            request_id=event_id,
+        )
+        async for chunk in stream_json_field(
+            timed_stream(
+                emma_dietary_agent.act(
+                    question, 0, "default", emma_nutrition, context, stream=True
+                ),
+                request_id=event_id,
+                intent="dietary",
+                model=model,
+            )
         ):
-            response = chunk.choices[0].message.content
-            resp_json = extract_json_from_text(response)
-            chunk.choices[0].message.content = resp_json["message"]
             yield chunk
     elif int(choice.get("choice")) == 2:
-        print("food & nutrition")
         emma_nutrition_agent = ChatAgent(
             AgentConfig(user_id=config["user_id"], session_id=config["session_id"])
         )
-        emma_format_agent = ChatAgent(
-            AgentConfig(user_id=config["user_id"], session_id=config["session_id"])
+        context, _ = await assemble_context(
+            {
+                "userinfo": get_user_info(config["user_id"], is_formated=True),
+                "food_preference": get_user_preference_summary(config["user_id"]),
+                "glu_summary": get_glu_summary(config["user_id"]),
+                "meal": functools.partial(
+                    calculate_nutrition_per_day,
+                    config["user_id"],
+                    datetime.datetime.now(),
+                ),
+                "products": get_products,
+            },
+            fallbacks=CONTEXT_FALLBACKS,
+            timeouts=CONTEXT_TIMEOUTS,
+            request_id=event_id,
         )
-        context = {
-            "userinfo": await get_user_info(config["user_id"], is_formated=True),
-            "food_preference": await get_user_preference_summary(config["user_id"]),
-            "glu_summary": await get_glu_summary(config["user_id"]),
-            "meal": calculate_nutrition_per_day(
-                config["user_id"], datetime.datetime.now()
-            ),
-            "products": get_products(),
-        }
-        async for chunk in emma_nutrition_agent.act(
-            question, 0, "default", emma_nutrition, context
-        ):
-            response = chunk.choices[0].message.content
-            resp_json = extract_json_from_text(response)
-            async for format_chunk in emma_format_agent.act(
-                question,
-                0,
-                "default",
-                emma_format_chat,
-                {"content": resp_json["message"]},
-                stream=True,
-            ):
-                yield format_chunk
+        answer = stream_json_field(
+            timed_stream(
+                emma_nutrition_agent.act(
+                    question, 0, "default", emma_nutrition, context, stream=True
+                ),
+                request_id=event_id,
+                intent="nutrition",
+                model=model,
+            )
+        )
+        async for chunk in match_query_language(question, answer):
+            yield chunk
     elif int(choice.get("choice")) == 3:
-        print("health")
         emma_future_agent = ChatAgent(
             AgentConfig(user_id=config["user_id"], session_id=config["session_id"])
         )
@@ -156,44 +370,63 @@ async def workflow(
             ga_weeks = 12
         else:
             ga_weeks = userinfo["ga"]
-        if config["is_thought"]:
-            async for chunk in emma_future_agent.act(
-                question, 0, "default", emma_future, {"context": ga_weeks}, stream=True
-            ):
+
+        async def health_answer():
+            answer = timed_stream(
+                emma_future_agent.act(
+                    question,
+                    0,
+                    "default",
+                    emma_future,
+                    {"context": ga_weeks},
+                    stream=True,
+                ),
+                request_id=event_id,
+                intent="health",
+                model=model,
+            )
+            if not config["is_thought"]:
+                answer = stream_json_field(answer)
+            async for chunk in answer:
                 yield chunk
-        else:
-            async for chunk in emma_future_agent.act(
-                question, 0, "default", emma_future, {"context": ga_weeks}, stream=False
-            ):
-                response = chunk.choices[0].message.content
-            resp_json = extract_json_from_text(response)
-            chunk.choices[0].message.content = resp_json["message"]
+
+        # first turns only depend on the gestational age and the answer style
+        scope = f"health:ga{ga_weeks}:thought{int(bool(config['is_thought']))}:first"
+        async for chunk in semantic_cached(
+            question,
+            config["organization"],
+            scope,
+            health_answer(),
+            event_id,
+            model,
+            session=(config["user_id"], config["session_id"]),
+        ):
             yield chunk
     elif int(choice.get("choice")) == 4:
-        print("exercise")
         emma_agent = ChatAgent(
             AgentConfig(user_id=config["user_id"], session_id=config["session_id"])
         )
         userinfo = await get_user_info(config["user_id"])
-        if config["is_thought"]:
-            async for chunk in emma_agent.act(
-                question, 0, "default", emma_fitness, stream=True
-            ):
-                yield chunk
-        else:
-            async for chunk in emma_agent.act(
-                question, 0, "default", emma_fitness, stream=False
-            ):
-                resp_json = extract_json_from_text(chunk.choices[0].message.content)
-            chunk.choices[0].message.content = resp_json["message"]
+        answer = timed_stream(
+            emma_agent.act(question, 0, "default", emma_fitness, stream=True),
+            request_id=event_id,
+            intent="exercise",
+            model=model,
+        )
+        if not config["is_thought"]:
+            answer = stream_json_field(answer)
+        async for chunk in answer:
             yield chunk
     else:
-        print("chat")
         emma_chat_agent = ChatAgent(
             AgentConfig(user_id=config["user_id"], session_id=config["session_id"])
         )
-        async for chunk in emma_chat_agent.act(
-            question, 0, "default", emma_chat, stream=True
+        # personal and emotional answers are never shared through the semantic cache
+        async for chunk in timed_stream(
+            emma_chat_agent.act(question, 0, "default", emma_chat, stream=True),
+            request_id=event_id,
+            intent="chat",
+            model=model,
         ):
             yield chunk
 
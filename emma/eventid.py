@@ -0,0 +1,52 @@
+"""
+Event ids "chatcmpl-<fp>-<n>" without a Redis round trip per request.
+Each worker reserves a block of EVENT_ID_BLOCK numbers with one INCRBY on the
+shared event_num counter and hands them out locally, so ids stay unique across
+workers (and with anything still calling INCR event_num).
+"""
+
+import asyncio
+
+from .redisclient import redis_client
+from .settings import settings
+
+EVENT_ID_BLOCK = settings.event_id_block
+
+
+class EventIdAllocator:
+    def __init__(self, block: int = EVENT_ID_BLOCK, client=None):
+        self.block = block
+        self.client = client
+        self.fingerprint = None
+        self._next = 1
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _reserve(self) -> None:
+        """Reserve the next block and refresh the fingerprint in one round trip"""
+        client = self.client or redis_client()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.get("fp")
+            pipe.incrby("event_num", self.block)
+            fingerprint, end = await pipe.execute()
+        if fingerprint is None:
+            raise RuntimeError("Redis key 'fp' is not set")
+        self.fingerprint = fingerprint.decode()
+        self._next = end - self.block + 1
+        self._end = end
+
+    async def next_number(self) -> int:
+        if self._next > self._end:
+            async with self._lock:
+                if self._next > self._end:
+                    await self._reserve()
+        number = self._next
+        self._next += 1
+        return number
+
+    async def next_id(self) -> str:
+        number = await self.next_number()
+        return f"chatcmpl-{self.fingerprint}-{number}"
+
+
+event_ids = EventIdAllocator()
@@ -0,0 +1,63 @@
+"""
+Shared HTTP client for the Bloom backend (profile, glucose, ...).
+One pooled client is kept per process so requests reuse keep-alive connections.
+"""
+
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+
+from ..settings import settings
+
+if TYPE_CHECKING:
+    import httpx
+
+BLOOM_KEY = settings.bloom_key
+BLOOM_API_URL = settings.bloom_api_url
+BLOOM_MAX_CONNECTIONS = settings.bloom_max_connections
+BLOOM_MAX_KEEPALIVE = settings.bloom_max_keepalive
+BLOOM_KEEPALIVE_EXPIRY = settings.bloom_keepalive_expiry
+BLOOM_TIMEOUT = settings.bloom_timeout
+
+_client = None
+
+
+def bloom_client() -> "httpx.AsyncClient":
+    """Return the process-wide client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx
+
+        _client = httpx.AsyncClient(
+            base_url=BLOOM_API_URL,
+            headers={"Authorization": f"Bearer {BLOOM_KEY}"},
+            limits=httpx.Limits(
+                max_connections=BLOOM_MAX_CONNECTIONS,
+                max_keepalive_connections=BLOOM_MAX_KEEPALIVE,
+                keepalive_expiry=BLOOM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=BLOOM_TIMEOUT,
+        )
+    return _client
+
+
+def set_bloom_client(client: "httpx.AsyncClient") -> None:
+    """Replace the shared client, e.g. with one using a custom transport."""
+    global _client
+    _client = client
+
+
+async def close_bloom_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """FastAPI lifespan hook: `FastAPI(lifespan=lifespan)`."""
+    bloom_client()
+    try:
+        yield
+    finally:
+        await close_bloom_client()
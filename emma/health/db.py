@@ -1,22 +1,11 @@
 import datetime
-import os
 
-from dotenv import load_dotenv
 from peewee import *
-from playhouse.postgres_ext import ArrayField, BinaryJSONField, PostgresqlExtDatabase
+from playhouse.postgres_ext import ArrayField, BinaryJSONField
 
+from ..database import db
 from ..utils import make_table_name
 
-load_dotenv()
-
-db = PostgresqlExtDatabase(
-    os.getenv("DB_NAME"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-    host=os.getenv("DB_HOST", "localhost"),
-    port=os.getenv("DB_PORT", 19032),
-)
-
 
 class BaseModel(Model):
     class Meta:
@@ -39,6 +28,9 @@ class MealData(BaseModel):
     created_at = DateTimeField(default=datetime.datetime.now)
     updated_at = DateTimeField()
 
+    class Meta:
+        indexes = ((("userid", "created_at"), False),)
+
 
 class FoodDatabase(BaseModel):
     id = AutoField(primary_key=True)
@@ -89,14 +81,31 @@ class Emma(BaseModel):
 
 
 class UserNutrition(BaseModel):
+    """Daily nutrient totals of a user, maintained from MealData by the trigger of health/rollup.py"""
+
     id = AutoField(primary_key=True)
     userid = CharField(max_length=255)
+    day = DateField()
     macro = BinaryJSONField()
     micro = BinaryJSONField()
     mineral = BinaryJSONField()
     created_at = DateTimeField(default=datetime.datetime.now)
     updated_at = DateTimeField()
 
+    class Meta:
+        indexes = ((("userid", "day"), True),)
+
+
+class GluSummary(BaseModel):
+    """LLM summary of a user's latest glucose records, keyed by their digest"""
+
+    id = AutoField(primary_key=True)
+    userid = CharField(max_length=255, unique=True)
+    digest = CharField(max_length=64)
+    summary = TextField()
+    created_at = DateTimeField(default=datetime.datetime.now)
+    updated_at = DateTimeField()
+
 
 class DietaryData(BaseModel):
     id = AutoField(primary_key=True)
@@ -120,5 +129,16 @@ class UserPreference(BaseModel):
 
 if __name__ == "__main__":
     db.create_tables(
-        [MealData, FoodDatabase, ExerciseData, ExerciseDatabase, Emma, DietaryData]
+        [
+            MealData,
+            FoodDatabase,
+            ExerciseData,
+            ExerciseDatabase,
+            Emma,
+            DietaryData,
+            GluSummary,
+            UserNutrition,
+        ]
     )
+    # tables created before the composite index was declared
+    MealData._schema.create_indexes(safe=True)
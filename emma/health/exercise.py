@@ -1,3 +1,23 @@
+"""
+Exercise records and summaries for the Emma application.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Tuple
+
+from capybara.llm import llm
+
+from ..aiodb import run_db
+from ..logger import logger
+from ..metrics import span
+from ..prompt import emma_exercise_summary
+from ..utils import extract_json_from_text
+from .db import ExerciseData, ExerciseDatabase, db
+from .model import EmmaComment, UserBasicInfo
+from .nutrient import fetch_user_profile, format_exercise_records
+
+
 def cal_calories_met(weight: float, duration: float, met: float) -> float:
     met * duration / 60 * 1.05 * weight
 
@@ -12,26 +32,17 @@ def cal_exercise_bpm_range(age: int) -> Tuple[int, int]:
     return (int(0.6 * (220 - age)), int(0.89 * (220 - age)))
 
 
-async def get_exercise_summary(
-    user_id: str,
-    exercise: str,
-    intensity: str,
-    duration: float,
-    bpm: float,
-    start_time,
-    remark: str,
-) -> Tuple[EmmaComment, float]:
-    """
-    TODO: How to get the meal time?
-    """
-    # get from db
+def load_exercise_records(
+    user_id: str, exercise: str, intensity: str
+) -> Tuple[ExerciseDatabase, list]:
+    """The exercise's MET entry and the user's exercise records of the last 7 days"""
     with db.atomic():
         exercise_data = ExerciseDatabase.get_or_none(
             (ExerciseDatabase.exercise == exercise)
             & (ExerciseDatabase.type == intensity)
         )
         # Get exercise records
-        previous_records = (
+        previous_records = list(
             ExerciseData.select()
             .where(
                 (ExerciseData.user_id == user_id)
@@ -43,23 +54,37 @@ async def get_exercise_summary(
             )
             .order_by(ExerciseData.created_at.desc())
         )
+    return exercise_data, previous_records
+
+
+async def get_exercise_summary(
+    user_id: str,
+    exercise: str,
+    intensity: str,
+    duration: float,
+    bpm: float,
+    start_time,
+    remark: str,
+) -> Tuple[EmmaComment, float]:
+    """
+    TODO: How to get the meal time?
+    """
+    # get from db on a worker thread, concurrently with the user profile
+    with span("context.exercise"):
+        (exercise_data, previous_records), user_profile = await asyncio.gather(
+            run_db(load_exercise_records, user_id, exercise, intensity),
+            fetch_user_profile(user_id),
+        )
     # calcualte caories. Check ExerciseDatabase for the formula
     if not exercise_data:
         met = 0.0  # Default value
     else:
         met = exercise_data.calories
     # get user info
-    user_data_response = await httpx.AsyncClient().get(
-        f"http://localhost:8000/api/v1/profile/user/{user_id}",
-        headers={"Authorization": f"Bearer {BLOOM_KEY}"},
-    )
-    user_data_response.raise_for_status()
-    # user_data = user_data_response.json()
-    user_data = UserBasicInfo(**user_data_response.json())
+    user_data = UserBasicInfo(**user_profile["raw"])
     # print(user_data)
     # Calculate calories based on duration and base calories from database
-    print("met: ", met)
-    print("weight: ", user_data.cur_weight)
+    logger.debug("met: %s, weight: %s", met, user_data.cur_weight)
     calories = cal_calories_met(
         float(user_data.cur_weight), float(duration), float(met)
     )
@@ -77,7 +102,7 @@ async def get_exercise_summary(
     exercise_records = format_exercise_records(previous_records)
     # calculate exercise bpm range
     min_bpm, max_bpm = cal_exercise_bpm_range(user_data.age)
-    print({"min": min_bpm, "max": max_bpm})
+    logger.debug("bpm range: %s-%s", min_bpm, max_bpm)
     # prompt
     prompt = emma_exercise_summary(
         new_record,
@@ -88,8 +113,11 @@ async def get_exercise_summary(
         user_data.complications,
         {"min": min_bpm, "max": max_bpm},
     )
-    print(prompt)
-    llm_json = extract_json_from_text(await llm(prompt, is_text=True))
+    logger.debug(prompt)
+    with span("llm.exercise_summary"):
+        response = await llm(prompt, is_text=True)
+    with span("json_parse", source="exercise_summary"):
+        llm_json = extract_json_from_text(response)
     if not calories:
         calories = llm_json["calories"]
     return EmmaComment(**llm_json), calories
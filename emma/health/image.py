@@ -0,0 +1,107 @@
+"""
+Preprocessing of meal photos before they are sent to the vision model.
+Phone photos are decoded, rotated upright from their EXIF orientation, scaled
+down to the resolution the model actually looks at and re-encoded as JPEG.
+Without Pillow, or for data that does not decode, the original bytes are sent
+with their own mime type.
+"""
+
+import base64
+import io
+from typing import Optional, Tuple
+
+from ..settings import settings
+
+# qwen-vl tiles images into 28px patches and caps the pixel count; larger
+# uploads only add transfer time
+VISION_MAX_SIDE = settings.vision_max_side
+VISION_JPEG_QUALITY = settings.vision_jpeg_quality
+# base64 is encoded in blocks of this many input bytes (a multiple of 3)
+BASE64_BLOCK = 3 * 2**16
+EXIF_ORIENTATION = 0x0112
+# (offset, signature, mime) of the formats phones and browsers upload
+SIGNATURES = (
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"GIF8", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (4, b"ftypheic", "image/heic"),
+    (4, b"ftypavif", "image/avif"),
+    (0, b"BM", "image/bmp"),
+)
+
+
+def sniff_mime(data: bytes, default: str = "image/jpeg") -> str:
+    """Mime type of an encoded image from its leading bytes"""
+    for offset, signature, mime in SIGNATURES:
+        if data[offset : offset + len(signature)] == signature:
+            return mime
+    return default
+
+
+def prepare_image(
+    data: bytes,
+    max_side: int = VISION_MAX_SIDE,
+    quality: int = VISION_JPEG_QUALITY,
+    mime: Optional[str] = None,
+) -> Tuple[bytes, str]:
+    """
+    Return the (image bytes, mime type) to send for an uploaded image.
+    JPEGs that are already upright and small enough are passed through as is.
+    The original bytes go out with `mime`, sniffed from the data when not given.
+    """
+    original = data, mime or sniff_mime(data)
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return original
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            rotated = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+            if (
+                image.format == "JPEG"
+                and not rotated
+                and max(image.size) <= max_side
+            ):
+                return original
+            # let the JPEG decoder scale down by up to 8x while decoding
+            image.draft("RGB", (max_side, max_side))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=quality, optimize=True)
+    except Exception:
+        return original
+    if output.tell() >= len(data):
+        return original
+    return output.getvalue(), "image/jpeg"
+
+
+def data_url(data: bytes, mime: str = "image/jpeg") -> str:
+    """
+    data: URL of the image, base64 encoded block by block so that only the
+    result and one block are held besides the input
+    """
+    view = memoryview(data)
+    output = io.StringIO()
+    output.write(f"data:{mime};base64,")
+    for start in range(0, len(view), BASE64_BLOCK):
+        output.write(base64.b64encode(view[start : start + BASE64_BLOCK]).decode())
+    return output.getvalue()
+
+
+def decode_data_url(url: str) -> Tuple[bytes, str]:
+    header, _, payload = url.partition(",")
+    data = base64.b64decode(payload)
+    mime = header[len("data:") :].split(";", 1)[0] or sniff_mime(data)
+    return data, mime
+
+
+def prepare_image_url(url: str) -> str:
+    """Preprocess a base64 data: URL; remote URLs are fetched by the model itself"""
+    if not url.startswith("data:"):
+        return url
+    data, mime = decode_data_url(url)
+    return data_url(*prepare_image(data, mime=mime))
@@ -2,18 +2,21 @@
 Core module for the Emma Nutrition application.
 """
 
-import os
+import asyncio
+import base64
+import hashlib
 import traceback
 from datetime import datetime, timedelta
-from typing import Any, Dict, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-import dotenv
-import httpx
 import orjson
 from capybara.llm import llm
 from fastapi import HTTPException
 
+from ..aiodb import run_db
+from ..cache import ImageResultCache, TTLCache
 from ..logger import logger
+from ..metrics import span
 from ..prompt import (
     emma_exercise_summary,
     emma_glu_summary,
@@ -21,7 +24,12 @@ from ..prompt import (
     get_food_nutrients_prompt,
     user_preference_summary,
 )
+from ..redisclient import redis_client
+from ..settings import settings
 from ..utils import extract_json_from_text
+from .client import bloom_client
+from .db import GluSummary
+from .image import data_url, prepare_image, prepare_image_url
 from .model import (
     DietaryData,
     DietarySummary,
@@ -32,9 +40,29 @@ from .model import (
     UserBasicInfo,
     UserPreferenceData,
 )
-
-dotenv.load_dotenv()
-BLOOM_KEY = os.getenv("BLOOM_KEY")
+from .rollup import read_nutrition_per_day
+
+# Profiles change a few times a week but are read on almost every turn
+PROFILE_CACHE_SIZE = settings.profile_cache_size
+PROFILE_CACHE_TTL = settings.profile_cache_ttl
+PROFILE_UPDATE_CHANNEL = settings.profile_update_channel
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+# Nutrition of meal photos by image content, meal type and guidelines; photos
+# whose dHash differs in at most MEAL_PHOTO_MAX_DISTANCE of 64 bits also match
+MEAL_PHOTO_CACHE_SIZE = settings.meal_photo_cache_size
+MEAL_PHOTO_CACHE_TTL = settings.meal_photo_cache_ttl
+MEAL_PHOTO_MAX_DISTANCE = settings.meal_photo_max_distance
+meal_photo_cache = ImageResultCache(
+    maxsize=MEAL_PHOTO_CACHE_SIZE,
+    ttl=MEAL_PHOTO_CACHE_TTL,
+    max_distance=MEAL_PHOTO_MAX_DISTANCE,
+)
+# Vision calls in flight per analyze_nutrient_batch
+NUTRIENT_BATCH_CONCURRENCY = settings.nutrient_batch_concurrency
+# Stored glucose summaries are regenerated when the prompt template changes
+GLU_SUMMARY_VERSION = hashlib.sha256(
+    emma_glu_summary.__wrapped__.__doc__.encode()
+).digest()
 
 
 async def analyze_food(image_url: str, userinfo: str, history: str) -> list[dict]:
@@ -42,13 +70,17 @@ async def analyze_food(image_url: str, userinfo: str, history: str) -> list[dict
     Analyze food image to get the food name and portion
     """
     try:
+        image_url = await asyncio.to_thread(prepare_image_url, image_url)
         # query
         query = [
             {"type": "text", "text": get_food_info_prompt(userinfo, history)},
             {"type": "image_url", "image_url": {"url": image_url}},
         ]
         # Analyze food image
-        food_info = await llm(query, model="qwen-vl-max", temperature=0.1, is_text=True)
+        with span("llm.food_info", model="qwen-vl-max"):
+            food_info = await llm(
+                query, model="qwen-vl-max", temperature=0.1, is_text=True
+            )
         return food_info
     except Exception as e:
         error_traceback = traceback.format_exc()
@@ -58,20 +90,42 @@ async def analyze_food(image_url: str, userinfo: str, history: str) -> list[dict
         )
 
 
-async def analyze_nutrient(
-    user_id, image_base64: str, meal_type: int, products: str
-) -> list[NutritionMacro, NutritionMicro, NutritionMineral]:
-    url = f"data:image/jpeg;base64,{image_base64}"
-    userinfo = await get_user_info(user_id, is_formated=False)
+def meal_guidelines(userinfo: Any) -> Dict[str, float]:
+    """Daily calorie and protein targets of a user, defaults without a profile"""
     if type(userinfo) is str:
         userinfo = {"pre_weight": 59.3, "is_twin": False, "height": 1.77, "ga": 12}
     bmi = userinfo["pre_weight"] / (userinfo["height"] ** 2)
-    guidelines = {
+    return {
         "calories": cal_calories_gdm(
             bmi, userinfo["pre_weight"], userinfo["is_twin"], userinfo["ga"]
         ),
         "protein": cal_protein(userinfo["ga"]),
     }
+
+
+async def analyze_meal_photo(
+    image_base64: str,
+    meal_type: int,
+    products: str,
+    guidelines: Dict[str, float],
+    user_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Nutrients of a meal photo. The same photo under the same inputs is analyzed
+    once for everyone; a near-duplicate photo reuses an analysis of the same user.
+    """
+    context = orjson.dumps(
+        [meal_type, products, guidelines], option=orjson.OPT_SORT_KEYS
+    ).decode()
+    owner = None if user_id is None else str(user_id)
+    image = base64.b64decode(image_base64)
+    fingerprint = await asyncio.to_thread(meal_photo_cache.fingerprint, image)
+    cached = meal_photo_cache.get(fingerprint, context, owner)
+    if cached is not None:
+        return orjson.loads(cached)
+    with span("image.prepare"):
+        url = await asyncio.to_thread(lambda: data_url(*prepare_image(image)))
+    del image
     prompt = [
         {
             "type": "text",
@@ -82,17 +136,67 @@ async def analyze_nutrient(
         {"type": "image_url", "image_url": {"url": url}},
     ]
     try:
-        result = await llm(prompt, model="qwen-vl-max", temperature=0.1, is_text=True)
-        nutrition_data = extract_json_from_text(result)["items"][0]
+        with span("llm.food_nutrients", model="qwen-vl-max"):
+            result = await llm(
+                prompt, model="qwen-vl-max", temperature=0.1, is_text=True
+            )
+        with span("json_parse", source="food_nutrients"):
+            nutrition_data = extract_json_from_text(result)["items"][0]
         # print(nutrition_data)
+        meal_photo_cache.set(
+            fingerprint, context, orjson.dumps(nutrition_data), owner
+        )
         return nutrition_data
     except Exception as e:
         error_traceback = traceback.format_exc()
-        print(f"Error analyzing food image: {error_traceback}")
         logger.error(f"Error analyzing food image: {error_traceback}")
         raise e
 
 
+async def analyze_nutrient(
+    user_id, image_base64: str, meal_type: int, products: str
+) -> list[NutritionMacro, NutritionMicro, NutritionMineral]:
+    userinfo = await get_user_info(user_id, is_formated=False)
+    return await analyze_meal_photo(
+        image_base64, meal_type, products, meal_guidelines(userinfo), user_id
+    )
+
+
+async def analyze_nutrient_batch(
+    user_id, images: List[Tuple[str, int]], products: str
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Analyze several (image_base64, meal_type) photos of one user.
+    The profile and guidelines are loaded once, at most NUTRIENT_BATCH_CONCURRENCY
+    vision calls run at a time, and {"index", "nutrient"} or {"index", "error"}
+    results are yielded in completion order.
+    """
+    userinfo = await get_user_info(user_id, is_formated=False)
+    guidelines = meal_guidelines(userinfo)
+    semaphore = asyncio.Semaphore(NUTRIENT_BATCH_CONCURRENCY)
+
+    async def analyze(index: int, image_base64: str, meal_type: int):
+        async with semaphore:
+            try:
+                nutrient = await analyze_meal_photo(
+                    image_base64, meal_type, products, guidelines, user_id
+                )
+                return {"index": index, "nutrient": nutrient}
+            except Exception as e:
+                return {"index": index, "error": str(e)}
+
+    tasks = [
+        asyncio.create_task(analyze(index, image_base64, meal_type))
+        for index, (image_base64, meal_type) in enumerate(images)
+    ]
+    try:
+        for result in asyncio.as_completed(tasks):
+            yield await result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 # async def dietary_recommendation(
 #     user_id: str,
 # ) -> list[DietarySummary, list[DietaryData]]:
@@ -193,19 +297,54 @@ def cal_protein(ga: int) -> int:
 #     return "\n".join([f"{i+1}. {p.name}: {p.brief}" for i, p in enumerate(products)])
 
 
+async def fetch_user_profile(user_id: str) -> Dict[str, Any]:
+    """
+    Return the cached profile entry of a user, loading it from the profile API on a miss.
+    The entry holds the raw profile and its formatted string, filled on first use.
+    """
+    entry = profile_cache.get(str(user_id))
+    if entry is None:
+        with span("bloom.profile"):
+            response = await bloom_client().get(f"/profile/user/{user_id}")
+            response.raise_for_status()
+        entry = {"raw": response.json(), "formatted": None}
+        profile_cache.set(str(user_id), entry)
+    return entry
+
+
 async def get_user_info(user_id: str, is_formated=False) -> str:
     try:
-        user_data = await httpx.AsyncClient().get(
-            f"http://localhost:8000/api/v1/profile/user/{user_id}",
-            headers={"Authorization": f"Bearer {BLOOM_KEY}"},
-        )
+        entry = await fetch_user_profile(user_id)
         if is_formated:
-            return format_user_basic_info(user_data.json())
-        return user_data.json()
+            if entry["formatted"] is None:
+                entry["formatted"] = format_user_basic_info(entry["raw"])
+            return entry["formatted"]
+        return entry["raw"]
     except:
         return "暂无"
 
 
+def invalidate_user_info(user_id: str) -> None:
+    """Drop a cached profile. Call whenever the profile of the user is updated."""
+    profile_cache.invalidate(str(user_id))
+
+
+async def watch_profile_updates() -> None:
+    """
+    Invalidate cached profiles on update events published by the profile service.
+    Each message on PROFILE_UPDATE_CHANNEL is the id of an updated user.
+    Run it as a background task of the application lifespan.
+    """
+    pubsub = redis_client().pubsub()
+    await pubsub.subscribe(PROFILE_UPDATE_CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                invalidate_user_info(message["data"].decode())
+    finally:
+        await pubsub.aclose()
+
+
 def format_user_basic_info(data: Dict[str, Any]) -> str:
     info = UserBasicInfo(**data)
     formatted = []
@@ -232,91 +371,87 @@ def format_user_basic_info(data: Dict[str, Any]) -> str:
     return "\n".join(formatted)
 
 
-# def get_meal_data(user_id: str, date: datetime, offset: int) -> list[MealData]:
-#     start_date = date - timedelta(days=offset)
-#     meals = MealData.select(
-#         MealData.type, MealData.food, MealData.nutrient, MealData.created_at
-#     ).where(
-#         (MealData.userid == user_id) & (MealData.created_at.between(start_date, date))
-#     )
-#     return meals
-
-
-# def calculate_nutrition_per_day(user_id: str, date: datetime) -> dict:
-#     """
-#     Get 7 days meal record to calculate the nutrition from food per day
-#     """
-#     # get meal data
-#     meals = get_meal_data(user_id, date, 7)
-#     # group them by date
-#     # Group meals by day
-#     daily_totals = {}
-
-#     for meal in meals:
-#         # Truncate datetime to day
-#         day = meal.created_at.date()
-
-#         if day not in daily_totals:
-#             daily_totals[day] = {
-#                 "macro": NutritionMacro(calories=0, protein=0, fat=0, carb=0),
-#                 "micro": NutritionMicro(fa=0, vc=0, vd=0),
-#                 "mineral": NutritionMineral(calcium=0, iron=0, zinc=0, iodine=0),
-#             }
-#         # Add nutrients from current meal
-#         nutrients = meal.nutrient
-#         macro = nutrients["macro"]
-#         micro = nutrients["micro"]
-#         mineral = nutrients["mineral"]
-#         # Sum macro nutrients
-#         daily_totals[day]["macro"].calories += macro.get("calories", 0)
-#         daily_totals[day]["macro"].protein += macro.get("protein", 0)
-#         daily_totals[day]["macro"].fat += macro.get("fat", 0)
-#         daily_totals[day]["macro"].carb += macro.get("carb", 0)
-#         # Sum micro nutrients
-#         daily_totals[day]["micro"].fa += micro.get("fa", 0)
-#         daily_totals[day]["micro"].vc += micro.get("vc", 0)
-#         daily_totals[day]["micro"].vd += micro.get("vd", 0)
-#         # Sum minerals
-#         daily_totals[day]["mineral"].calcium += mineral.get("calcium", 0)
-#         daily_totals[day]["mineral"].iron += mineral.get("iron", 0)
-#         daily_totals[day]["mineral"].zinc += mineral.get("zinc", 0)
-#         daily_totals[day]["mineral"].iodine += mineral.get("iodine", 0)
-#     # Format output string
-#     output = []
-#     for day, nutrients in sorted(daily_totals.items()):
-#         macro = nutrients["macro"]
-#         micro = nutrients["micro"]
-#         mineral = nutrients["mineral"]
-#         # final string
-#         day_str = f"Day {day.strftime('%m-%d')}: "
-#         day_str += f"Calories {macro.calories:.1f}g, "
-#         day_str += f"Protein {macro.protein:.1f}g, "
-#         day_str += f"Fat {macro.fat:.1f}g, "
-#         day_str += f"Carb {macro.carb:.1f}g, "
-#         day_str += f"Folic Acid {micro.fa:.1f}mcg, "
-#         day_str += f"VitC {micro.vc:.1f}mg, "
-#         day_str += f"VitD {micro.vd:.1f}mcg, "
-#         day_str += f"Calcium {mineral.calcium:.1f}mg, "
-#         day_str += f"Iron {mineral.iron:.1f}mg, "
-#         day_str += f"Zinc {mineral.zinc:.1f}mg, "
-#         day_str += f"Iodine {mineral.iodine:.1f}mcg"
-#         output.append(day_str)
-#     return "".join(output)
+def format_nutrition_per_day(daily_totals: list[tuple]) -> str:
+    output = []
+    for (
+        day,
+        cal,
+        protein,
+        fat,
+        carb,
+        fa,
+        vc,
+        vd,
+        calcium,
+        iron,
+        zinc,
+        iodine,
+    ) in daily_totals:
+        day_str = f"Day {day.strftime('%m-%d')}: "
+        day_str += f"Calories {cal:.1f}g, "
+        day_str += f"Protein {protein:.1f}g, "
+        day_str += f"Fat {fat:.1f}g, "
+        day_str += f"Carb {carb:.1f}g, "
+        day_str += f"Folic Acid {fa:.1f}mcg, "
+        day_str += f"VitC {vc:.1f}mg, "
+        day_str += f"VitD {vd:.1f}mcg, "
+        day_str += f"Calcium {calcium:.1f}mg, "
+        day_str += f"Iron {iron:.1f}mg, "
+        day_str += f"Zinc {zinc:.1f}mg, "
+        day_str += f"Iodine {iodine:.1f}mcg"
+        output.append(day_str)
+    return "\n".join(output)
+
+
+def calculate_nutrition_per_day(user_id: str, date: datetime) -> str:
+    """
+    Get 7 days meal record to calculate the nutrition from food per day
+    """
+    start_date = date - timedelta(days=7)
+    return format_nutrition_per_day(read_nutrition_per_day(user_id, start_date, date))
+
+
+def glu_records_digest(glu_records: Any) -> str:
+    """Changes only when new readings arrive or the summary prompt changes"""
+    payload = orjson.dumps(glu_records, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(GLU_SUMMARY_VERSION + payload).hexdigest()
 
 
 async def get_glu_summary(user_id: str) -> list:
     current_date = datetime.now().strftime("%Y-%m-%d")
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"http://localhost:8000/api/v1/glucose/user/{user_id}",
+        with span("bloom.glucose"):
+            response = await bloom_client().get(
+                f"/glucose/user/{user_id}",
                 params={"date": current_date, "offset": 7},
-                headers={"Authorization": f"Bearer {BLOOM_KEY}"},
             )
             response.raise_for_status()
-            glu_records = response.json()
-            prompt = emma_glu_summary(glu_records)
-            return await llm(prompt)
+        glu_records = response.json()
+        digest = glu_records_digest(glu_records)
+        cached = await run_db(GluSummary.get_or_none, GluSummary.userid == str(user_id))
+        if cached and cached.digest == digest:
+            return cached.summary
+        prompt = emma_glu_summary(glu_records)
+        with span("llm.glu_summary"):
+            summary = await llm(prompt)
+        await run_db(
+            GluSummary.insert(
+                userid=str(user_id),
+                digest=digest,
+                summary=summary,
+                updated_at=datetime.now(),
+            )
+            .on_conflict(
+                conflict_target=[GluSummary.userid],
+                update={
+                    GluSummary.digest: digest,
+                    GluSummary.summary: summary,
+                    GluSummary.updated_at: datetime.now(),
+                },
+            )
+            .execute
+        )
+        return summary
     except Exception as e:
         logger.error(f"Failed to get glucose data: {str(e)}")
         return []
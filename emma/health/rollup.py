@@ -0,0 +1,258 @@
+"""
+Daily nutrition rollups: one UserNutrition row per user and day, kept in step
+with MealData by a trigger on its table, so every writer of meals updates the
+rollup in the same transaction whatever code path it takes. Install the
+trigger, then backfill the days written before it:
+
+    python -m emma.health.rollup install
+    python -m emma.health.rollup backfill [--user USER] [--days 30]
+    python -m emma.health.rollup check [--user USER] [--days 30]
+"""
+
+import argparse
+import datetime
+from typing import Any, Dict, List, Optional
+
+from peewee import Case, fn
+
+from .db import MealData, UserNutrition, db
+from .model import NutritionMacro, NutritionMicro, NutritionMineral
+
+# Nutrient fields stored in MealData.nutrient, grouped as in the JSON
+NUTRIENT_FIELDS = (
+    ("macro", tuple(NutritionMacro.model_fields)),
+    ("micro", tuple(NutritionMicro.model_fields)),
+    ("mineral", tuple(NutritionMineral.model_fields)),
+)
+FIELD_COUNT = sum(len(names) for _, names in NUTRIENT_FIELDS)
+# Absolute difference tolerated between a rollup and the raw meals
+TOLERANCE = 1e-3
+
+
+def _number(value):
+    """A nutrient as float; values the LLM wrote as text ("12g", "unknown") count as 0"""
+    return Case(
+        None, [(fn.jsonb_typeof(value.as_json()) == "number", value.cast("float"))], 0
+    )
+
+
+def aggregate_nutrition_per_day(
+    user_id: str, start_date: datetime.datetime, end_date: datetime.datetime
+) -> List[tuple]:
+    """
+    Sum the nutrients of a user's meals per day in SQL.
+    Returns (day, calories, protein, fat, carb, fa, vc, vd, calcium, iron, zinc, iodine)
+    tuples ordered by day.
+    """
+    day = fn.date_trunc("day", MealData.created_at)
+    totals = [
+        fn.COALESCE(fn.SUM(_number(MealData.nutrient[group][name])), 0)
+        for group, names in NUTRIENT_FIELDS
+        for name in names
+    ]
+    return list(
+        MealData.select(day, *totals)
+        .where(
+            (MealData.userid == user_id)
+            & (MealData.created_at.between(start_date, end_date))
+        )
+        .group_by(day)
+        .order_by(day)
+        .tuples()
+    )
+
+
+def read_nutrition_per_day(
+    user_id: str, start_date: datetime.datetime, end_date: datetime.datetime
+) -> List[tuple]:
+    """Same tuples as aggregate_nutrition_per_day, read from the rollups"""
+    rows = (
+        UserNutrition.select()
+        .where(
+            (UserNutrition.userid == user_id)
+            & (UserNutrition.day.between(start_date.date(), end_date.date()))
+        )
+        .order_by(UserNutrition.day)
+    )
+    return [
+        (row.day,)
+        + tuple(
+            float(getattr(row, group).get(name, 0))
+            for group, names in NUTRIENT_FIELDS
+            for name in names
+        )
+        for row in rows
+    ]
+
+
+def _field(source: str, name: str) -> str:
+    """SQL of _number: a failing cast would abort the write of the meal itself"""
+    return (
+        f"CASE WHEN jsonb_typeof({source}->'{name}') = 'number' "
+        f"THEN ({source}->>'{name}')::float ELSE 0 END"
+    )
+
+
+def _build(value) -> List[str]:
+    """jsonb_build_object of every nutrient group, with value(group, name) per field"""
+    return [
+        "jsonb_build_object("
+        + ", ".join(f"'{name}', {value(group, name)}" for name in names)
+        + ")"
+        for group, names in NUTRIENT_FIELDS
+    ]
+
+
+def trigger_sql() -> List[str]:
+    """
+    Statements of the trigger that adds the nutrients of every inserted meal to
+    the rollup of its day, subtracts those of deleted meals, and moves those of
+    edited meals, in the transaction of the write.
+    """
+    meals = MealData._meta.table_name
+    rollups = UserNutrition._meta.table_name
+    inserted = ",\n        ".join(
+        _build(lambda group, name: "p_sign * " + _field(f"p_nutrient->'{group}'", name))
+    )
+    added = ",\n        ".join(
+        f"{group} = {value}"
+        for (group, _), value in zip(
+            NUTRIENT_FIELDS,
+            _build(
+                lambda group, name: _field(f"t.{group}", name)
+                + " + "
+                + _field(f"EXCLUDED.{group}", name)
+            ),
+        )
+    )
+    return [
+        f"""CREATE OR REPLACE FUNCTION {rollups}_apply(
+    p_userid varchar, p_day date, p_nutrient jsonb, p_sign integer
+) RETURNS void AS $$
+BEGIN
+    IF p_nutrient IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO "{rollups}" AS t
+        (userid, day, macro, micro, mineral, created_at, updated_at)
+    VALUES (
+        p_userid, p_day,
+        {inserted},
+        now(), now()
+    )
+    ON CONFLICT (userid, day) DO UPDATE SET
+        {added},
+        updated_at = now();
+END;
+$$ LANGUAGE plpgsql""",
+        f"""CREATE OR REPLACE FUNCTION {rollups}_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM {rollups}_apply(OLD.userid, OLD.created_at::date, OLD.nutrient, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM {rollups}_apply(NEW.userid, NEW.created_at::date, NEW.nutrient, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql""",
+        f'DROP TRIGGER IF EXISTS {rollups}_rollup ON "{meals}"',
+        f"""CREATE TRIGGER {rollups}_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF userid, created_at, nutrient ON "{meals}"
+    FOR EACH ROW EXECUTE FUNCTION {rollups}_trigger()""",
+    ]
+
+
+def install_trigger() -> None:
+    """Create or replace the rollup trigger on MealData"""
+    with db.atomic():
+        for statement in trigger_sql():
+            db.execute_sql(statement)
+
+
+def _users(user_id: Optional[str]) -> List[str]:
+    if user_id:
+        return [user_id]
+    return [row[0] for row in MealData.select(MealData.userid).distinct().tuples()]
+
+
+def _window(days: int):
+    end = datetime.datetime.now()
+    start = datetime.datetime.combine(
+        end.date() - datetime.timedelta(days=days), datetime.time.min
+    )
+    return start, end
+
+
+def _as_groups(values: tuple) -> Dict[str, Dict[str, float]]:
+    groups, i = {}, 0
+    for group, names in NUTRIENT_FIELDS:
+        groups[group] = {name: float(values[i + j]) for j, name in enumerate(names)}
+        i += len(names)
+    return groups
+
+
+def backfill(user_id: Optional[str] = None, days: int = 30) -> int:
+    """Recompute the rollups of the last `days` days from the raw meals"""
+    start, end = _window(days)
+    written = 0
+    for user in _users(user_id):
+        with db.atomic():
+            # meals written meanwhile would fire the trigger on rows being rebuilt
+            db.execute_sql(f'LOCK TABLE "{MealData._meta.table_name}" IN SHARE MODE')
+            UserNutrition.delete().where(
+                (UserNutrition.userid == user)
+                & (UserNutrition.day.between(start.date(), end.date()))
+            ).execute()
+            rows = [
+                {
+                    "userid": user,
+                    "day": day.date(),
+                    "updated_at": datetime.datetime.now(),
+                    **_as_groups(values),
+                }
+                for day, *values in aggregate_nutrition_per_day(user, start, end)
+            ]
+            if rows:
+                UserNutrition.insert_many(rows).execute()
+        written += len(rows)
+    return written
+
+
+def check(user_id: Optional[str] = None, days: int = 30) -> List[Dict[str, Any]]:
+    """Days whose rollup differs from the sum of the raw meals"""
+    start, end = _window(days)
+    mismatches = []
+    for user in _users(user_id):
+        expected = {
+            row[0].date(): row[1:]
+            for row in aggregate_nutrition_per_day(user, start, end)
+        }
+        actual = {row[0]: row[1:] for row in read_nutrition_per_day(user, start, end)}
+        for day in sorted(set(expected) | set(actual)):
+            want = expected.get(day, (0.0,) * FIELD_COUNT)
+            got = actual.get(day, (0.0,) * FIELD_COUNT)
+            if any(abs(float(a) - float(b)) > TOLERANCE for a, b in zip(want, got)):
+                mismatches.append(
+                    {"userid": user, "day": day, "expected": want, "actual": got}
+                )
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain daily nutrition rollups")
+    parser.add_argument("command", choices=["install", "backfill", "check"])
+    parser.add_argument("--user", default=None)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == "install":
+        install_trigger()
+        print("installed the rollup trigger, run backfill for earlier meals")
+    elif args.command == "backfill":
+        print(f"wrote {backfill(args.user, args.days)} daily rollups")
+    else:
+        mismatches = check(args.user, args.days)
+        for mismatch in mismatches:
+            print(mismatch)
+        print(f"{len(mismatches)} inconsistent days")
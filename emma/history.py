@@ -0,0 +1,266 @@
+"""
+Conversation history of a session, stored in the UserHistory table.
+The last HISTORY_WINDOW turns of each active session are kept in a window that
+add_turn appends to: a capped Redis list shared by the workers, or an
+in-process cache with HISTORY_CACHE=memory. A turn reads its history from the
+window without querying the table. Older turns are read page by page with
+keyset pagination. Each page continues below the (created_at, id) of the
+previous one and is read in order from the
+(user_id, session_id, is_deleted, created_at, id) index, so the cost of a page
+does not grow with the length of the session.
+"""
+
+import datetime
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import orjson as json
+import peewee
+
+from .aiodb import run_db
+from .cache import TTLCache
+from .db import UserHistory
+from .logger import logger
+from .metrics import span
+from .redisclient import redis_client
+from .settings import settings
+
+# Turns kept per session, enough for the prompt of the next turn
+HISTORY_WINDOW = settings.history_window
+# Seconds a window is kept after the last turn of its session
+HISTORY_WINDOW_TTL = settings.history_window_ttl
+HISTORY_CACHE = settings.history_cache
+HISTORY_PAGE_SIZE = settings.history_page_size
+# Sessions kept by the in-process window
+MEMORY_WINDOW_SESSIONS = 10000
+
+# (created_at, id) of a turn, its position in the session
+Cursor = Tuple[datetime.datetime, int]
+Turn = Dict[str, Any]
+
+TURN_FIELDS = (
+    UserHistory.id,
+    UserHistory.role,
+    UserHistory.message,
+    UserHistory.state,
+    UserHistory.created_at,
+)
+
+
+def _turn(row: UserHistory) -> Turn:
+    return {
+        "id": row.id,
+        "role": row.role,
+        "message": row.message,
+        "state": row.state,
+        "created_at": row.created_at,
+    }
+
+
+def _session(user_id: str, session_id) -> peewee.Expression:
+    return (
+        (UserHistory.user_id == str(user_id))
+        & (UserHistory.session_id == session_id)
+        & (UserHistory.is_deleted == False)  # noqa: E712
+    )
+
+
+def cursor_of(turn: Turn) -> Cursor:
+    return turn["created_at"], turn["id"]
+
+
+def history_page(
+    user_id: str,
+    session_id,
+    limit: int = HISTORY_PAGE_SIZE,
+    before: Optional[Cursor] = None,
+) -> List[Turn]:
+    """
+    Up to `limit` turns of a session older than `before`, newest first.
+    Pass cursor_of(the last turn of a page) as `before` to read the next page.
+    """
+    query = UserHistory.select(*TURN_FIELDS).where(_session(user_id, session_id))
+    if before is not None:
+        query = query.where(
+            peewee.Tuple(UserHistory.created_at, UserHistory.id)
+            < peewee.Tuple(*before)
+        )
+    query = query.order_by(UserHistory.created_at.desc(), UserHistory.id.desc())
+    return [_turn(row) for row in query.limit(limit)]
+
+
+def iter_history(
+    user_id: str, session_id, page_size: int = HISTORY_PAGE_SIZE
+) -> Iterator[Turn]:
+    """Every turn of a session, newest first, reading one page at a time"""
+    before = None
+    while True:
+        page = history_page(user_id, session_id, page_size, before)
+        yield from page
+        if len(page) < page_size:
+            return
+        before = cursor_of(page[-1])
+
+
+def _dumps(turn: Turn) -> bytes:
+    return json.dumps(turn)
+
+
+def _loads(item: bytes) -> Turn:
+    turn = json.loads(item)
+    turn["created_at"] = datetime.datetime.fromisoformat(turn["created_at"])
+    return turn
+
+
+class RedisHistoryWindow:
+    """Recent turns of each session in a capped Redis list, shared by all workers"""
+
+    def __init__(
+        self, size: int = HISTORY_WINDOW, ttl: float = HISTORY_WINDOW_TTL, client=None
+    ):
+        self.size = size
+        self.ttl = int(ttl)
+        self.client = client
+
+    def _key(self, user_id: str, session_id) -> str:
+        return f"emma:history:{user_id}:{session_id}"
+
+    async def get(self, user_id: str, session_id) -> Optional[List[Turn]]:
+        """The window in chronological order, None when the session has none"""
+        key = self._key(user_id, session_id)
+        async with (self.client or redis_client()).pipeline(transaction=False) as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.expire(key, self.ttl)
+            items, _ = await pipe.execute()
+        if not items:
+            return None
+        return [_loads(item) for item in items]
+
+    async def set(self, user_id: str, session_id, turns: List[Turn]) -> None:
+        key = self._key(user_id, session_id)
+        async with (self.client or redis_client()).pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.rpush(key, *(_dumps(turn) for turn in turns[-self.size :]))
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def append(self, user_id: str, session_id, turn: Turn) -> None:
+        """Add a turn to an existing window; without one the next read loads it"""
+        key = self._key(user_id, session_id)
+        async with (self.client or redis_client()).pipeline(transaction=True) as pipe:
+            pipe.rpushx(key, _dumps(turn))
+            pipe.ltrim(key, -self.size, -1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def invalidate(self, user_id: str, session_id) -> None:
+        await (self.client or redis_client()).delete(self._key(user_id, session_id))
+
+
+class MemoryHistoryWindow:
+    """Recent turns of each session in this process, for a single worker"""
+
+    def __init__(
+        self,
+        size: int = HISTORY_WINDOW,
+        ttl: float = HISTORY_WINDOW_TTL,
+        maxsize: int = MEMORY_WINDOW_SESSIONS,
+    ):
+        self.size = size
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, user_id: str, session_id) -> Optional[List[Turn]]:
+        key = (str(user_id), str(session_id))
+        turns = self.cache.get(key)
+        if turns is None:
+            return None
+        # keep the window of an active session from expiring
+        self.cache.set(key, turns)
+        return list(turns)
+
+    async def set(self, user_id: str, session_id, turns: List[Turn]) -> None:
+        self.cache.set((str(user_id), str(session_id)), deque(turns, maxlen=self.size))
+
+    async def append(self, user_id: str, session_id, turn: Turn) -> None:
+        key = (str(user_id), str(session_id))
+        turns = self.cache.get(key)
+        if turns is not None:
+            turns.append(turn)
+            self.cache.set(key, turns)
+
+    async def invalidate(self, user_id: str, session_id) -> None:
+        self.cache.invalidate((str(user_id), str(session_id)))
+
+
+history_window = (
+    MemoryHistoryWindow() if HISTORY_CACHE == "memory" else RedisHistoryWindow()
+)
+
+
+async def recent_turns(
+    user_id: str, session_id, limit: int = HISTORY_WINDOW
+) -> List[Turn]:
+    """
+    The last `limit` turns of a session in chronological order, from the window
+    when it holds enough turns, otherwise from the table (refilling the window).
+    """
+    if limit <= 0:
+        return []
+    if limit <= HISTORY_WINDOW:
+        try:
+            turns = await history_window.get(user_id, session_id)
+        except Exception as e:
+            logger.error(f"History window read failed: {str(e)}")
+            turns = None
+        if turns is not None:
+            return turns[-limit:]
+    with span("db.history"):
+        page = await run_db(
+            history_page, user_id, session_id, max(limit, HISTORY_WINDOW)
+        )
+    turns = page[::-1]
+    if turns:
+        try:
+            await history_window.set(user_id, session_id, turns[-HISTORY_WINDOW:])
+        except Exception as e:
+            logger.error(f"History window write failed: {str(e)}")
+    return turns[-limit:]
+
+
+async def add_turn(
+    user_id: str,
+    session_id,
+    role: str,
+    message: str,
+    state: Optional[str] = None,
+    user_meta: Optional[Dict[str, Any]] = None,
+) -> Turn:
+    """Store a turn and append it to the window of its session"""
+    row = await run_db(
+        UserHistory.create,
+        user_id=str(user_id),
+        session_id=session_id,
+        user_meta=user_meta,
+        role=role,
+        message=message,
+        state=state,
+    )
+    turn = _turn(row)
+    try:
+        await history_window.append(user_id, session_id, turn)
+    except Exception as e:
+        logger.error(f"History window append failed: {str(e)}")
+        # a window missing this turn must not be served
+        try:
+            await history_window.invalidate(user_id, session_id)
+        except Exception:
+            pass
+    return turn
+
+
+async def delete_history(user_id: str, session_id) -> int:
+    """Soft delete every turn of a session, returning the number of turns"""
+    query = UserHistory.update(is_deleted=True).where(_session(user_id, session_id))
+    count = await run_db(query.execute)
+    await history_window.invalidate(user_id, session_id)
+    return count
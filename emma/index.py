@@ -0,0 +1,246 @@
+"""
+Approximate nearest neighbour (pgvector HNSW / IVFFlat) indexes for the embedding tables.
+
+    python -m emma.index create --table emma_vector1536 --method hnsw --ops cosine
+    python -m emma.index rebuild --table emma_vector1536 --method hnsw --ops cosine
+    python -m emma.index report --table emma_vector1536
+    python -m emma.index recall --table emma_vector1536 --ops cosine --ef-search 80
+"""
+
+import argparse
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from .db import VECTOR_TABLES, MemoryModel, db
+
+# pgvector can only index `vector` columns up to this many dimensions;
+# wider columns are indexed (and must be queried) through a halfvec cast
+MAX_VECTOR_INDEX_DIM = 2000
+
+DISTANCE_OPS = {
+    "cosine": ("cosine_ops", "<=>"),
+    "l2": ("l2_ops", "<->"),
+    "ip": ("ip_ops", "<#>"),
+}
+
+ANN_TABLES = {
+    model._meta.table_name: model
+    for model in list(VECTOR_TABLES.values()) + [MemoryModel]
+}
+
+
+def embedding_dim(table: str) -> int:
+    return ANN_TABLES[table].embedding.dimensions
+
+
+def embedding_expr(table: str) -> str:
+    """Column expression the index is built on; queries must order by the same one."""
+    dim = embedding_dim(table)
+    if dim > MAX_VECTOR_INDEX_DIM:
+        return f"(embedding::halfvec({dim}))"
+    return "embedding"
+
+
+def vector_type(table: str) -> str:
+    dim = embedding_dim(table)
+    return f"halfvec({dim})" if dim > MAX_VECTOR_INDEX_DIM else f"vector({dim})"
+
+
+def index_name(table: str, method: str, ops: str) -> str:
+    return f"{table}_embedding_{method}_{ops}_idx"
+
+
+def create_index(
+    table: str,
+    method: str = "hnsw",
+    ops: str = "cosine",
+    m: int = 16,
+    ef_construction: int = 64,
+    lists: Optional[int] = None,
+    concurrently: bool = True,
+) -> str:
+    """
+    Create the ANN index of a table. IVFFlat lists default to rows / 1000
+    (sqrt(rows) above one million rows), as recommended by pgvector.
+    """
+    prefix = "halfvec_" if embedding_dim(table) > MAX_VECTOR_INDEX_DIM else "vector_"
+    opclass = prefix + DISTANCE_OPS[ops][0]
+    if method == "hnsw":
+        params = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    elif method == "ivfflat":
+        if lists is None:
+            rows = count_rows(table)
+            lists = max(rows // 1000, 1) if rows <= 1_000_000 else int(rows**0.5)
+        params = f"lists = {int(lists)}"
+    else:
+        raise ValueError(f"Unknown index method: {method}")
+    name = index_name(table, method, ops)
+    db.execute_sql(
+        f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS "{name}" '
+        f'ON "{table}" USING {method} ({embedding_expr(table)} {opclass}) WITH ({params})'
+    )
+    return name
+
+
+def drop_index(table: str, method: str, ops: str, concurrently: bool = True) -> None:
+    name = index_name(table, method, ops)
+    db.execute_sql(
+        f'DROP INDEX {"CONCURRENTLY " if concurrently else ""}IF EXISTS "{name}"'
+    )
+
+
+def rebuild_index(table: str, method: str, ops: str, concurrently: bool = True) -> None:
+    name = index_name(table, method, ops)
+    db.execute_sql(f'REINDEX INDEX {"CONCURRENTLY " if concurrently else ""}"{name}"')
+
+
+def count_rows(table: str) -> int:
+    """Planner estimate of the row count, exact counts are too slow on large tables"""
+    cursor = db.execute_sql(
+        "SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = %s",
+        (table,),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def index_report(table: str) -> List[Dict]:
+    cursor = db.execute_sql(
+        """
+        SELECT i.indexname, i.indexdef,
+               pg_relation_size(quote_ident(i.indexname)::regclass)
+        FROM pg_indexes i
+        WHERE i.tablename = %s AND i.indexdef ~* 'USING (hnsw|ivfflat)'
+        """,
+        (table,),
+    )
+    return [
+        {"name": name, "definition": definition, "size": size}
+        for name, definition, size in cursor.fetchall()
+    ]
+
+
+@contextmanager
+def search_params(ef_search: Optional[int] = None, probes: Optional[int] = None):
+    """
+    Query-time ANN knobs scoped to a transaction:
+    hnsw.ef_search trades speed for recall on HNSW, ivfflat.probes on IVFFlat.
+    """
+    with db.atomic():
+        if ef_search is not None:
+            db.execute_sql(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+        if probes is not None:
+            db.execute_sql(f"SET LOCAL ivfflat.probes = {int(probes)}")
+        yield
+
+
+def nearest_ids(table: str, vector: str, ops: str, k: int) -> List[int]:
+    operator = DISTANCE_OPS[ops][1]
+    cursor = db.execute_sql(
+        f'SELECT id FROM "{table}" ORDER BY {embedding_expr(table)} {operator} '
+        f"%s::{vector_type(table)} LIMIT %s",
+        (vector, k),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def sample_vectors(table: str, sample: int) -> List[str]:
+    rows = max(count_rows(table), 1)
+    percent = min(100.0, max(sample * 10 * 100.0 / rows, 0.01))
+    cursor = db.execute_sql(
+        f'SELECT embedding::text FROM "{table}" TABLESAMPLE SYSTEM (%s) LIMIT %s',
+        (percent, sample),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def measure_recall(
+    table: str,
+    ops: str = "cosine",
+    k: int = 10,
+    sample: int = 50,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+) -> Dict[str, float]:
+    """Recall@k of the ANN index against an exact scan, on a sample of stored vectors"""
+    recalls, ann_times, exact_times = [], [], []
+    for vector in sample_vectors(table, sample):
+        start = time.perf_counter()
+        with search_params(ef_search, probes):
+            approx = nearest_ids(table, vector, ops, k)
+        ann_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        with db.atomic():
+            db.execute_sql("SET LOCAL enable_indexscan = off")
+            exact = nearest_ids(table, vector, ops, k)
+        exact_times.append(time.perf_counter() - start)
+        if exact:
+            recalls.append(len(set(approx) & set(exact)) / len(exact))
+    if not recalls:
+        return {"samples": 0}
+    return {
+        "samples": len(recalls),
+        "recall": sum(recalls) / len(recalls),
+        "ann_ms": sum(ann_times) / len(ann_times) * 1000,
+        "exact_ms": sum(exact_times) / len(exact_times) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manage ANN indexes of embedding tables"
+    )
+    parser.add_argument(
+        "command", choices=["create", "drop", "rebuild", "report", "recall"]
+    )
+    parser.add_argument("--table", required=True, choices=sorted(ANN_TABLES))
+    parser.add_argument("--method", default="hnsw", choices=["hnsw", "ivfflat"])
+    parser.add_argument("--ops", default="cosine", choices=sorted(DISTANCE_OPS))
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--probes", type=int, default=None)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--sample", type=int, default=50)
+    parser.add_argument("--no-concurrently", action="store_true")
+    args = parser.parse_args()
+
+    db.connect()
+    concurrently = not args.no_concurrently
+    if args.command == "create":
+        start = time.perf_counter()
+        name = create_index(
+            args.table,
+            args.method,
+            args.ops,
+            m=args.m,
+            ef_construction=args.ef_construction,
+            lists=args.lists,
+            concurrently=concurrently,
+        )
+        print(f"created {name} in {time.perf_counter() - start:.1f}s")
+    elif args.command == "drop":
+        drop_index(args.table, args.method, args.ops, concurrently)
+    elif args.command == "rebuild":
+        start = time.perf_counter()
+        rebuild_index(args.table, args.method, args.ops, concurrently)
+        print(f"rebuilt in {time.perf_counter() - start:.1f}s")
+    elif args.command == "report":
+        print(f"rows (estimate): {count_rows(args.table)}")
+        for index in index_report(args.table):
+            print(f"{index['name']}: {index['size'] / 2**20:.1f} MiB")
+            print(f"    {index['definition']}")
+    else:
+        print(
+            measure_recall(
+                args.table,
+                args.ops,
+                k=args.k,
+                sample=args.sample,
+                ef_search=args.ef_search,
+                probes=args.probes,
+            )
+        )
+    db.close()
@@ -0,0 +1,233 @@
+"""
+Bulk ingestion of documents into Document and the emma_vector* tables.
+Documents are grouped until they have COPY_ROWS chunks. The chunks of a group
+are embedded in shared batches, however small each document is, and written
+with binary COPY in one transaction on a database worker. A document is
+committed together with its Document row, so an interrupted run resumes by
+skipping the doc_ids that already exist.
+
+    python -m emma.ingest --organization bloom --dim 1792 docs/*.md
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import io
+import os
+import struct
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+import orjson as json
+
+from .aiodb import run_db
+from .db import VECTOR_TABLES, Document, db
+from .embedding import embed
+from .logger import logger
+
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 100
+# texts per embedding request and embedding requests in flight
+EMBED_BATCH = 64
+EMBED_CONCURRENCY = 4
+# vector rows per COPY transaction, and chunks embedded together
+COPY_ROWS = 5000
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+COPY_COLUMNS = ("doc_id", "text", "embedding", "organization", "meta")
+
+
+def chunk_text(
+    text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP
+) -> List[str]:
+    """Split text into overlapping windows, preferring to cut at a newline"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = text.rfind("\n", start + size // 2, end)
+            if cut != -1:
+                end = cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def _text_field(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack(">i", len(data)) + data
+
+
+def _vector_field(vector: List[float]) -> bytes:
+    dim = len(vector)
+    return struct.pack(f">ihh{dim}f", 4 + 4 * dim, dim, 0, *vector)
+
+
+def _jsonb_field(value: Dict[str, Any]) -> bytes:
+    data = b"\x01" + json.dumps(value)
+    return struct.pack(">i", len(data)) + data
+
+
+def encode_copy_rows(
+    rows: Iterable[Tuple[str, str, List[float], str, Dict]],
+) -> io.BytesIO:
+    """Encode (doc_id, text, embedding, organization, meta) rows for COPY ... BINARY"""
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    field_count = struct.pack(">h", len(COPY_COLUMNS))
+    for doc_id, text, embedding, organization, meta in rows:
+        buffer.write(field_count)
+        buffer.write(_text_field(doc_id))
+        buffer.write(_text_field(text))
+        buffer.write(_vector_field(embedding))
+        buffer.write(_text_field(organization))
+        buffer.write(_jsonb_field(meta))
+    buffer.write(COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+def write_batch(table: str, documents: List[Dict[str, Any]], rows: List[Tuple]) -> None:
+    """Write the Document rows and their vectors in one transaction"""
+    now = datetime.datetime.now()
+    with db.atomic():
+        Document.insert_many(
+            [
+                {
+                    "doc_id": doc["doc_id"],
+                    "filename": doc["filename"],
+                    "organization": doc["organization"],
+                    "path": doc.get("path"),
+                    "description": doc.get("description"),
+                    "meta": doc.get("meta"),
+                    "updated_at": now,
+                }
+                for doc in documents
+            ]
+        ).execute()
+        cursor = db.cursor()
+        cursor.copy_expert(
+            f'COPY "{table}" ({", ".join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT BINARY)',
+            encode_copy_rows(rows),
+        )
+
+
+def ingested_doc_ids(doc_ids: List[str]) -> Set[str]:
+    """The given doc_ids that already have a Document row"""
+    query = Document.select(Document.doc_id).where(Document.doc_id.in_(doc_ids))
+    return {doc.doc_id for doc in query}
+
+
+async def embed_chunks(chunks: List[str], dimensions: int) -> List[List[float]]:
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def embed_batch(batch: List[str]) -> List[List[float]]:
+        async with semaphore:
+            return await embed(batch, dimensions=dimensions)
+
+    batches = [chunks[i : i + EMBED_BATCH] for i in range(0, len(chunks), EMBED_BATCH)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [vector for result in results for vector in result]
+
+
+async def ingest_documents(
+    documents: Iterable[Dict[str, Any]], dimensions: int
+) -> Dict[str, float]:
+    """
+    Ingest a stream of documents given as dicts with doc_id, filename, organization,
+    text and optional path, description and meta. Returns throughput statistics.
+    """
+    table = VECTOR_TABLES[dimensions]._meta.table_name
+    start = time.perf_counter()
+    skipped = total_docs = total_chunks = 0
+    write = None
+
+    async def write_group(group: List[Dict[str, Any]], rows: List[Tuple]) -> None:
+        nonlocal total_docs, total_chunks
+        await run_db(write_batch, table, group, rows)
+        total_docs += len(group)
+        total_chunks += len(rows)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"ingested {total_docs} documents, {total_chunks} chunks "
+            f"({total_chunks / elapsed:.1f} chunks/s)"
+        )
+
+    async def process(pending: List[Tuple[Dict[str, Any], List[str]]]) -> None:
+        nonlocal skipped, write
+        existing = await run_db(ingested_doc_ids, [doc["doc_id"] for doc, _ in pending])
+        skipped += len(existing)
+        pending = [(doc, chunks) for doc, chunks in pending if doc["doc_id"] not in existing]
+        if not pending:
+            return
+        # one set of embedding batches for the chunks of every document in the group
+        vectors = iter(
+            await embed_chunks(
+                [chunk for _, chunks in pending for chunk in chunks], dimensions
+            )
+        )
+        rows = []
+        for doc, chunks in pending:
+            for i, chunk in enumerate(chunks):
+                meta = {"filename": doc["filename"], "path": doc.get("path"), "chunk": i}
+                rows.append(
+                    (doc["doc_id"], chunk, next(vectors), doc["organization"], meta)
+                )
+        # the previous write overlaps with embedding of this group
+        if write:
+            await write
+        write = asyncio.create_task(write_group([doc for doc, _ in pending], rows))
+
+    pending, pending_chunks = [], 0
+    for doc in documents:
+        chunks = chunk_text(doc["text"])
+        pending.append((doc, chunks))
+        pending_chunks += len(chunks)
+        if pending_chunks >= COPY_ROWS:
+            await process(pending)
+            pending, pending_chunks = [], 0
+    if pending:
+        await process(pending)
+    if write:
+        await write
+    elapsed = time.perf_counter() - start
+    return {
+        "skipped": skipped,
+        "documents": total_docs,
+        "chunks": total_chunks,
+        "seconds": elapsed,
+        "chunks_per_second": total_chunks / elapsed if elapsed else 0.0,
+    }
+
+
+def load_files(paths: List[str], organization: str) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        yield {
+            "doc_id": hashlib.sha256(f"{organization}:{path}".encode()).hexdigest(),
+            "filename": os.path.basename(path),
+            "organization": organization,
+            "path": path,
+            "text": text,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk ingest documents")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--organization", required=True)
+    parser.add_argument("--dim", type=int, default=1792, choices=sorted(VECTOR_TABLES))
+    args = parser.parse_args()
+
+    stats = asyncio.run(
+        ingest_documents(load_files(args.paths, args.organization), args.dim)
+    )
+    print(stats)
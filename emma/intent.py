@@ -0,0 +1,335 @@
+"""
+Local first-stage intent classifier in front of the LLM router.
+It answers from a normalized-query decision cache, keyword rules or the
+nearest embedding centroid, and returns None when it is not confident so the
+caller falls back to UserIntentionRouter. Keyword rules (INTENT_KEYWORD_RULES)
+and centroids (INTENT_CENTROIDS) are off until enabled; check their accuracy
+against the logged decisions of the LLM router first:
+
+    python -m emma.intent evaluate ~/logs/perf.log --keywords
+    python -m emma.intent centroids ~/logs/perf.log --output centroids.json
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import orjson as json
+
+from .cache import TTLCache
+from .settings import settings
+
+# Keyword rules answer when the winning intent has INTENT_KEYWORD_MIN_HITS
+# distinct keywords in the query and INTENT_KEYWORD_MARGIN more than the runner-up
+INTENT_KEYWORD_RULES = settings.intent_keyword_rules
+INTENT_KEYWORD_MIN_HITS = settings.intent_keyword_min_hits
+INTENT_KEYWORD_MARGIN = settings.intent_keyword_margin
+# Cosine similarity and margin over the runner-up the nearest centroid needs
+INTENT_EMBEDDING_THRESHOLD = settings.intent_embedding_threshold
+INTENT_EMBEDDING_MARGIN = settings.intent_embedding_margin
+INTENT_CENTROIDS = settings.intent_centroids
+# Short queries ("ok", "然后呢") depend on the conversation, never cache them
+MIN_CACHED_QUERY = 6
+
+# Keywords per router choice, in the order of engine.user_intents. Only words
+# that name the topic itself: people, feelings or body parts ("老公", "feel",
+# "疼") also come up in questions about every other intent.
+INTENT_KEYWORDS = {
+    1: [
+        "食谱",
+        "饮食计划",
+        "饮食建议",
+        "饮食方案",
+        "吃什么",
+        "怎么吃",
+        "菜单",
+        "三餐",
+        "meal plan",
+        "diet plan",
+        "what should i eat",
+        "recipe",
+    ],
+    2: [
+        "营养",
+        "热量",
+        "卡路里",
+        "蛋白质",
+        "碳水",
+        "脂肪",
+        "维生素",
+        "叶酸",
+        "能吃吗",
+        "可以吃吗",
+        "升糖",
+        "calorie",
+        "nutrition",
+        "nutrient",
+        "protein",
+        "vitamin",
+    ],
+    3: [
+        "症状",
+        "吃药",
+        "药物",
+        "医生",
+        "医院",
+        "血压",
+        "头痛",
+        "头晕",
+        "发烧",
+        "出血",
+        "胎动",
+        "孕吐",
+        "symptom",
+        "medicine",
+        "doctor",
+        "pain",
+        "fever",
+        "bleeding",
+    ],
+    4: [
+        "运动",
+        "锻炼",
+        "散步",
+        "瑜伽",
+        "游泳",
+        "跑步",
+        "健身",
+        "心率",
+        "exercise",
+        "workout",
+        "yoga",
+        "walking",
+        "swimming",
+        "fitness",
+    ],
+    5: [
+        "心情",
+        "难过",
+        "开心",
+        "焦虑",
+        "压力",
+        "害怕",
+        "失眠",
+        "孤单",
+        "sad",
+        "happy",
+        "anxious",
+        "stress",
+        "lonely",
+        "worried",
+    ],
+}
+
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+_LATIN = re.compile(r"[a-z]")
+
+
+def keyword_pattern(word: str) -> re.Pattern:
+    """
+    Latin keywords match whole words (and their plural), so "pain" does not
+    match "Spain" or "painting"; CJK keywords match anywhere.
+    """
+    word = word.lower()
+    if not _LATIN.search(word):
+        return re.compile(re.escape(word))
+    return re.compile(rf"(?<![a-z]){re.escape(word)}(?:s|es)?(?![a-z])")
+
+
+def normalize_query(query: str) -> str:
+    return _PUNCTUATION.sub(" ", query.lower()).strip()
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class LocalIntentRouter:
+    def __init__(
+        self,
+        keywords: Optional[Dict[int, List[str]]] = INTENT_KEYWORDS,
+        centroids: Optional[Dict[int, List[float]]] = None,
+        keyword_min_hits: int = INTENT_KEYWORD_MIN_HITS,
+        keyword_margin: int = INTENT_KEYWORD_MARGIN,
+        embedding_threshold: float = INTENT_EMBEDDING_THRESHOLD,
+        embedding_margin: float = INTENT_EMBEDDING_MARGIN,
+        cache_size: int = 10000,
+    ):
+        self.keywords = {
+            choice: [keyword_pattern(word) for word in words]
+            for choice, words in (keywords or {}).items()
+        }
+        self.centroids = centroids or {}
+        self.keyword_min_hits = keyword_min_hits
+        self.keyword_margin = keyword_margin
+        self.embedding_threshold = embedding_threshold
+        self.embedding_margin = embedding_margin
+        self.decisions = TTLCache(maxsize=cache_size, ttl=24 * 3600)
+
+    @classmethod
+    def from_env(cls) -> "LocalIntentRouter":
+        centroids = None
+        if INTENT_CENTROIDS and os.path.exists(INTENT_CENTROIDS):
+            with open(INTENT_CENTROIDS, "rb") as f:
+                centroids = {int(k): v for k, v in json.loads(f.read()).items()}
+        return cls(
+            keywords=INTENT_KEYWORDS if INTENT_KEYWORD_RULES else None,
+            centroids=centroids,
+        )
+
+    def keyword_hits(self, query: str) -> Dict[int, int]:
+        """Number of distinct keywords of every intent found in the query"""
+        text = query.lower()
+        return {
+            choice: sum(1 for pattern in patterns if pattern.search(text))
+            for choice, patterns in self.keywords.items()
+        }
+
+    def keyword_choice(self, query: str) -> Optional[int]:
+        if not self.keywords:
+            return None
+        ranked = sorted(
+            ((hits, choice) for choice, hits in self.keyword_hits(query).items()),
+            reverse=True,
+        )
+        best, choice = ranked[0]
+        runner_up = ranked[1][0] if len(ranked) > 1 else 0
+        if best >= self.keyword_min_hits and best - runner_up >= self.keyword_margin:
+            return choice
+        return None
+
+    async def embedding_choice(self, query: str) -> Tuple[Optional[int], float]:
+        if not self.centroids:
+            return None, 0.0
+        from .embedding import embed
+
+        vector = (await embed([query]))[0]
+        ranked = sorted(
+            ((_cosine(vector, c), choice) for choice, c in self.centroids.items()),
+            reverse=True,
+        )
+        best, choice = ranked[0]
+        runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+        if (
+            best >= self.embedding_threshold
+            and best - runner_up >= self.embedding_margin
+        ):
+            return choice, best
+        return None, best
+
+    async def classify(self, query: str) -> Optional[Dict]:
+        """Return {"choice": int, "source": str} when confident, otherwise None"""
+        key = normalize_query(query)
+        if len(key) >= MIN_CACHED_QUERY:
+            choice = self.decisions.get(key)
+            if choice is not None:
+                return {"choice": choice, "source": "cache"}
+        choice = self.keyword_choice(query)
+        if choice is not None:
+            return {"choice": choice, "source": "keyword"}
+        try:
+            choice, _ = await self.embedding_choice(query)
+        except Exception:
+            choice = None
+        if choice is not None:
+            return {"choice": choice, "source": "embedding"}
+        return None
+
+    def remember(self, query: str, decision: Dict) -> None:
+        """Cache a decision of the LLM router; free-text replies are not cached"""
+        key = normalize_query(query)
+        if decision.get("choice") and len(key) >= MIN_CACHED_QUERY:
+            self.decisions.set(key, int(decision["choice"]))
+
+
+def read_decisions(path: str) -> Iterator[Tuple[str, int]]:
+    """(query, choice) pairs of the LLM router logged by engine.workflow"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            _, sep, payload = line.partition(" - route ")
+            if not sep:
+                continue
+            record = json.loads(payload)
+            if record.get("source") == "llm" and record.get("choice"):
+                yield record["query"], int(record["choice"])
+
+
+async def evaluate(router: LocalIntentRouter, decisions: List[Tuple[str, int]]) -> Dict:
+    """Coverage and accuracy against the LLM router, overall and per source"""
+    answered = correct = 0
+    sources = defaultdict(lambda: {"answered": 0, "correct": 0})
+    confusion = defaultdict(int)
+    for query, expected in decisions:
+        result = await router.classify(query)
+        if result is None:
+            continue
+        answered += 1
+        correct += result["choice"] == expected
+        sources[result["source"]]["answered"] += 1
+        sources[result["source"]]["correct"] += result["choice"] == expected
+        confusion[(expected, result["choice"])] += 1
+    return {
+        "decisions": len(decisions),
+        "coverage": answered / len(decisions) if decisions else 0.0,
+        "accuracy": correct / answered if answered else 0.0,
+        "sources": {
+            source: {
+                "coverage": counts["answered"] / len(decisions),
+                "accuracy": counts["correct"] / counts["answered"],
+            }
+            for source, counts in sources.items()
+        },
+        "errors": {f"{e}->{p}": n for (e, p), n in confusion.items() if e != p},
+    }
+
+
+async def build_centroids(decisions: List[Tuple[str, int]]) -> Dict[int, List[float]]:
+    from .embedding import embed
+
+    sums, counts = {}, defaultdict(int)
+    for i in range(0, len(decisions), 64):
+        batch = decisions[i : i + 64]
+        vectors = await embed([query for query, _ in batch])
+        for (_, choice), vector in zip(batch, vectors):
+            if choice not in sums:
+                sums[choice] = [0.0] * len(vector)
+            sums[choice] = [s + v for s, v in zip(sums[choice], vector)]
+            counts[choice] += 1
+    return {choice: [s / counts[choice] for s in sums[choice]] for choice in sums}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline tools for the local intent router"
+    )
+    parser.add_argument("command", choices=["evaluate", "centroids"])
+    parser.add_argument("log", help="log file with the routing decisions")
+    parser.add_argument("--output", default="centroids.json")
+    parser.add_argument(
+        "--keywords", action="store_true", help="evaluate the keyword rules too"
+    )
+    parser.add_argument("--min-hits", type=int, default=INTENT_KEYWORD_MIN_HITS)
+    parser.add_argument("--margin", type=int, default=INTENT_KEYWORD_MARGIN)
+    args = parser.parse_args()
+
+    decisions = list(read_decisions(args.log))
+    if args.command == "evaluate":
+        router = LocalIntentRouter.from_env()
+        if args.keywords:
+            router = LocalIntentRouter(
+                centroids=router.centroids,
+                keyword_min_hits=args.min_hits,
+                keyword_margin=args.margin,
+            )
+        print(asyncio.run(evaluate(router, decisions)))
+    else:
+        centroids = asyncio.run(build_centroids(decisions))
+        with open(args.output, "wb") as f:
+            f.write(json.dumps({str(k): v for k, v in centroids.items()}))
+        print(f"wrote {len(centroids)} centroids to {args.output}")
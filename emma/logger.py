@@ -1,21 +1,56 @@
+import atexit
 import logging
-from datetime import datetime
+import logging.handlers
+import queue
 from pathlib import Path
+from typing import Any, Optional
 
+import orjson as json
 
-log_dir = Path.home() / 'logs'
+from .settings import settings
+
+log_dir = Path(settings.log_dir or Path.home() / 'logs')
+log_dir.mkdir(parents=True, exist_ok=True)
+
+# Rotate on a schedule when LOG_ROTATE_WHEN is set (e.g. "midnight", "H"),
+# otherwise when a file reaches LOG_MAX_BYTES
+LOG_ROTATE_WHEN = settings.log_rotate_when
+LOG_MAX_BYTES = settings.log_max_bytes
+LOG_BACKUP_COUNT = settings.log_backup_count
+
+
+def rotating_handler(filename: str, level: int) -> logging.Handler:
+    # delay: the file is opened by the first record written to it, not on import
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_dir / filename,
+            when=LOG_ROTATE_WHEN,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding='utf-8',
+            delay=True,
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_dir / filename,
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding='utf-8',
+            delay=True,
+        )
+    handler.setLevel(level)
+    return handler
 
-# Set up main logger
-logger = logging.getLogger('main_logger')
-logger.setLevel(logging.DEBUG)  # Capture all levels
 
-# Create performance file handler for normal logging
-file_perf_handler = logging.FileHandler(log_dir / 'perf.log', encoding='utf-8')
-file_perf_handler.setLevel(logging.INFO)
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line from the `perf` attribute of a record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(
+            {"ts": record.created, **getattr(record, "perf", {})},
+            option=json.OPT_NON_STR_KEYS,
+            default=str,
+        ).decode()
 
-# Create error file handler for error logging
-file_error_handler = logging.FileHandler(log_dir / 'err.log', encoding='utf-8')
-file_error_handler.setLevel(logging.ERROR)
 
 # Create formatter with custom format and date format
 formatter = logging.Formatter(
@@ -23,14 +58,78 @@ formatter = logging.Formatter(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# Add formatter to handlers
+# perf.log gets normal logging, err.log errors only, perf.jsonl the perf records
+file_perf_handler = rotating_handler('perf.log', logging.INFO)
+file_error_handler = rotating_handler('err.log', logging.ERROR)
+file_record_handler = rotating_handler('perf.jsonl', logging.INFO)
 file_perf_handler.setFormatter(formatter)
 file_error_handler.setFormatter(formatter)
+file_record_handler.setFormatter(JsonLinesFormatter())
+
+# Loggers only enqueue records; a listener thread formats and writes them, so
+# a log call on the event loop never waits for the disk
+log_queue = queue.SimpleQueue()
+listener = logging.handlers.QueueListener(
+    log_queue,
+    file_perf_handler,
+    file_error_handler,
+    file_record_handler,
+    respect_handler_level=True,
+)
+
+
+class _RecordFilter(logging.Filter):
+    """Route perf records to perf.jsonl only"""
+
+    def __init__(self, perf: bool):
+        super().__init__()
+        self.perf = perf
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return hasattr(record, "perf") == self.perf
+
+
+file_perf_handler.addFilter(_RecordFilter(perf=False))
+file_error_handler.addFilter(_RecordFilter(perf=False))
+file_record_handler.addFilter(_RecordFilter(perf=True))
+
+# Set up main logger
+logger = logging.getLogger('main_logger')
+logger.setLevel(settings.log_level)
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+# Perf records are kept whatever LOG_LEVEL is, through the same queue
+perf_logger = logging.getLogger('perf_logger')
+perf_logger.setLevel(logging.INFO)
+perf_logger.propagate = False
+perf_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+listener.start()
+atexit.register(listener.stop)
+
+
+def log_perf(
+    stage: str, duration: float, request_id: Optional[str] = None, **fields: Any
+) -> None:
+    """
+    Write a structured perf record to perf.jsonl, e.g.
+    log_perf("route", 0.012, event_id, source="keyword", choice=2).
+    `duration` is in seconds and recorded as duration_ms.
+    """
+    perf_logger.info(
+        stage,
+        extra={
+            "perf": {
+                "stage": stage,
+                "duration_ms": round(duration * 1000, 3),
+                "request_id": request_id,
+                **fields,
+            }
+        },
+    )
 
-# Add handlers to logger
-logger.addHandler(file_perf_handler)
-logger.addHandler(file_error_handler)
 
 # Usage example:
 # logger.info("Performance log message")  # Goes to perf.log
-# logger.error("Error log message")       # Goes to err.log
\ No newline at end of file
+# logger.error("Error log message")       # Goes to err.log
+# log_perf("context", 0.25, event_id, intent="nutrition")  # Goes to perf.jsonl
@@ -0,0 +1,144 @@
+"""
+Semantic answer cache in front of the LLM, backed by the emma_memory table.
+Only answers that do not depend on the user's personal data should be cached;
+callers pass a scope that captures every input the answer depends on.
+Answers given inside a conversation also depend on its earlier turns, so for
+a session the cache only serves (and stores) the first turn.
+"""
+
+import time
+from typing import TYPE_CHECKING, Any, AsyncGenerator, List, Optional, Tuple
+
+from .aiodb import run_db
+from .db import MemoryModel
+from .embedding import embed
+from .history import add_turn, recent_turns
+from .logger import logger
+from .settings import settings
+from .utils import chunk_content
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionChunk
+
+# Minimum cosine similarity between two queries to reuse an answer
+SEMANTIC_CACHE_THRESHOLD = settings.semantic_cache_threshold
+# Characters per chunk when replaying a cached answer
+SEMANTIC_CACHE_CHUNK = 16
+
+
+def lookup_answer(
+    embedding: List[float], organization: str, scope: str
+) -> Optional[str]:
+    distance = MemoryModel.embedding.cosine_distance(embedding)
+    memory = (
+        MemoryModel.select(MemoryModel.ans, distance.alias("distance"))
+        .where(
+            (MemoryModel.organization == organization)
+            & (MemoryModel.meta["scope"] == scope)
+        )
+        .order_by(distance)
+        .limit(1)
+        .first()
+    )
+    if memory and 1 - memory.distance >= SEMANTIC_CACHE_THRESHOLD:
+        return memory.ans
+    return None
+
+
+def store_answer(
+    query: str, embedding: List[float], answer: str, organization: str, scope: str
+) -> None:
+    MemoryModel.create(
+        text=query,
+        embedding=embedding,
+        ans=answer,
+        organization=organization,
+        meta={"scope": scope},
+    )
+
+
+def build_answer_chunk(
+    content: Optional[str],
+    event_id: str,
+    model: str,
+    finish_reason: Optional[str] = None,
+) -> "ChatCompletionChunk":
+    """A streamed chunk of the same type the LLM client yields"""
+    from openai.types.chat import ChatCompletionChunk
+
+    return ChatCompletionChunk(
+        id=event_id,
+        object="chat.completion.chunk",
+        created=int(time.time()),
+        model=model,
+        choices=[
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }
+        ],
+    )
+
+
+async def is_first_turn(user_id: str, session_id) -> bool:
+    """Whether the session has no turns yet; False when that is unknown"""
+    try:
+        return not await recent_turns(user_id, session_id, 1)
+    except Exception as e:
+        logger.error(f"Semantic cache history check failed: {str(e)}")
+        return False
+
+
+async def semantic_cached(
+    query: str,
+    organization: str,
+    scope: str,
+    generate: AsyncGenerator[Any, None],
+    event_id: str,
+    model: str,
+    session: Optional[Tuple[str, Any]] = None,
+) -> AsyncGenerator[Any, None]:
+    """
+    Replay the cached answer of a similar query, or pass the chunks of `generate`
+    through and store the complete answer for the next similar query.
+    With the (user_id, session_id) of the turn, later turns of the session skip
+    the cache and a replayed answer is recorded in the session history, as the
+    agent would have done.
+    The cache never fails a turn: lookup or store errors fall back to the LLM.
+    """
+    if session is not None and not await is_first_turn(*session):
+        async for chunk in generate:
+            yield chunk
+        return
+    embedding = None
+    answer = None
+    try:
+        embedding = (await embed([query]))[0]
+        answer = await run_db(lookup_answer, embedding, organization, scope)
+    except Exception as e:
+        logger.error(f"Semantic cache lookup failed: {str(e)}")
+    if answer:
+        await generate.aclose()
+        for i in range(0, len(answer), SEMANTIC_CACHE_CHUNK):
+            yield build_answer_chunk(
+                answer[i : i + SEMANTIC_CACHE_CHUNK], event_id, model
+            )
+        if session is not None:
+            try:
+                await add_turn(*session, "user", query)
+                await add_turn(*session, "assistant", answer)
+            except Exception as e:
+                logger.error(f"Semantic cache history write failed: {str(e)}")
+        yield build_answer_chunk(None, event_id, model, finish_reason="stop")
+        return
+    parts = []
+    async for chunk in generate:
+        parts.append(chunk_content(chunk))
+        yield chunk
+    answer = "".join(parts)
+    if embedding and answer:
+        try:
+            await run_db(store_answer, query, embedding, answer, organization, scope)
+        except Exception as e:
+            logger.error(f"Semantic cache store failed: {str(e)}")
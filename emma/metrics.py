@@ -0,0 +1,196 @@
+"""
+In-process latency metrics for the chat workflow.
+Stages are timed with `span` (or `timed_stream` for LLM streams) and aggregated
+into histograms labelled by stage, intent and model. They are exported in the
+Prometheus text format, either served by `metrics_app` or written periodically
+to LOG_DIR/metrics.prom by `dump_metrics`.
+
+    app.mount("/metrics", metrics_app)
+"""
+
+import asyncio
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from .logger import log_dir, log_perf, logger
+from .settings import settings
+from .utils import chunk_content
+
+METRICS_DUMP_INTERVAL = settings.metrics_dump_interval
+
+# Seconds, from a cached lookup to a full generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 40, 80, 160)
+
+
+class Histogram:
+    """Prometheus-style histogram with one series per label set"""
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(
+                    f"{self.name}_bucket{{{labels + ',' if labels else ''}{le}}} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY: Dict[str, Histogram] = {}
+
+
+def histogram(
+    name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+) -> Histogram:
+    if name not in REGISTRY:
+        REGISTRY[name] = Histogram(name, help, buckets)
+    return REGISTRY[name]
+
+
+STAGE_SECONDS = histogram(
+    "emma_stage_seconds", "Duration of a workflow stage in seconds"
+)
+LLM_FIRST_TOKEN_SECONDS = histogram(
+    "emma_llm_first_token_seconds", "Time from request to the first streamed token"
+)
+LLM_TOKENS_PER_SECOND = histogram(
+    "emma_llm_tokens_per_second",
+    "Streamed chunks per second after the first token",
+    RATE_BUCKETS,
+)
+
+
+def record(
+    stage: str, duration: float, request_id: Optional[str] = None, **labels: Any
+) -> None:
+    """Add a measured stage duration, as a perf record too when given a request id"""
+    labels.setdefault("status", "ok")
+    STAGE_SECONDS.observe(duration, stage=stage, **labels)
+    if request_id:
+        log_perf(stage, duration, request_id, **labels)
+
+
+@contextmanager
+def span(stage: str, request_id: Optional[str] = None, **labels: Any):
+    """
+    Time a block as `stage`, labelled status="ok", "error" or "cancelled".
+    With a request id the duration is also written as a perf record.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, request_id, status=status, **labels)
+
+
+async def timed_stream(
+    chunks: AsyncGenerator[Any, None],
+    stage: str = "llm",
+    request_id: Optional[str] = None,
+    **labels: Any,
+) -> AsyncGenerator[Any, None]:
+    """Pass an LLM stream through, recording time to first token and token rate"""
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    with span(stage, request_id, **labels):
+        async for chunk in chunks:
+            if chunk_content(chunk):
+                tokens += 1
+                if first is None:
+                    first = time.perf_counter()
+                    LLM_FIRST_TOKEN_SECONDS.observe(first - start, **labels)
+            yield chunk
+    if first is not None and tokens > 1:
+        elapsed = time.perf_counter() - first
+        if elapsed > 0:
+            LLM_TOKENS_PER_SECOND.observe((tokens - 1) / elapsed, **labels)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_app(scope, receive, send) -> None:
+    """ASGI app answering every request with the metrics in text format"""
+    if scope["type"] != "http":
+        return
+    body = render_metrics().encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def dump_metrics(
+    interval: float = METRICS_DUMP_INTERVAL, path: Optional[str] = None
+) -> None:
+    """
+    Write the metrics to `path` (LOG_DIR/metrics.prom) every `interval` seconds,
+    e.g. for the node_exporter textfile collector. Run it as a background task.
+    """
+    path = path or os.path.join(log_dir, "metrics.prom")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            text = render_metrics()
+            tmp = path + ".tmp"
+            await asyncio.to_thread(_write, tmp, text)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.error(f"Failed to dump metrics: {str(e)}")
+
+
+def _write(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
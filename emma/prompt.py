@@ -4,21 +4,76 @@ Author: Yue Wu <wuyue681@gmail.com>
 """
 
 import inspect
-from functools import wraps
+import os
+from functools import lru_cache, wraps
+from typing import TYPE_CHECKING
 
-from jinja2 import Template
+from .settings import settings
+
+if TYPE_CHECKING:
+    import jinja2
+
+# Directory for compiled template bytecode, shared across worker processes.
+# Leave PROMPT_CACHE_DIR unset to keep compiled templates in memory only.
+PROMPT_CACHE_DIR = settings.prompt_cache_dir
+
+
+@lru_cache(maxsize=1)
+def environment() -> "jinja2.Environment":
+    """The jinja2 environment, created (and jinja2 imported) on the first render"""
+    from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader
+
+    bytecode_cache = None
+    if PROMPT_CACHE_DIR:
+        os.makedirs(PROMPT_CACHE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(
+            PROMPT_CACHE_DIR, "emma_prompt_%s.cache"
+        )
+    return Environment(
+        loader=FunctionLoader(_template_sources.get), bytecode_cache=bytecode_cache
+    )
+
+
+def _template(source: str) -> "jinja2.Template":
+    from jinja2 import Template
+
+    return Template(source)
+
+
+# Docstring templates registered by @prompt, keyed by function name
+_template_sources = {}
 
 
 def prompt(func):
+    """
+    Render the docstring of `func` as a jinja2 template with the call arguments.
+    The template is compiled once on first use and the parameter names are
+    resolved at decoration time, so a call only binds arguments and renders.
+    Parameters left out of a call render with their default value.
+    """
+    parameters = inspect.signature(func).parameters
+    param_names = tuple(parameters.keys())
+    defaults = {
+        name: param.default
+        for name, param in parameters.items()
+        if param.default is not inspect.Parameter.empty
+    }
+    template_name = f"{func.__module__}.{func.__qualname__}"
+    _template_sources[template_name] = func.__doc__
+    template = None
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        signature = inspect.signature(func)
-        context = dict(zip(signature.parameters.keys(), args))
+        nonlocal template
+        if template is None:
+            template = environment().get_template(template_name)
+        context = dict(defaults)
+        context.update(zip(param_names, args))
         context.update(kwargs)
-        template_str = func.__doc__
-        template = Template(template_str)
         return template.render(context)
 
+    wrapper.template_name = template_name
+    wrapper.param_names = param_names
     return wrapper
 
 
@@ -32,7 +87,7 @@ def basic_rag_prompt():
         Query: {{ question }}
         Answer:
     """
-    return Template(template)
+    return _template(template)
 
 
 def rag_with_examplar_prompt():
@@ -56,7 +111,7 @@ def rag_with_examplar_prompt():
         Query: {{ question }}
         Answer:
     """
-    return Template(template)
+    return _template(template)
 
 
 def rag_with_memory_prompt():
@@ -84,7 +139,7 @@ def rag_with_memory_prompt():
     根据部门负责人的安排进行工作汇报即可。无需更改原有答案，因为提供的上下文信息与原问题无关。 -> 根据部门负责人的安排进行工作汇报即可。
     Only output the <final answer>. Do not print any other information.
     """
-    return Template(template)
+    return _template(template)
 
 
 def rag_with_memory_prompt_cn():
@@ -107,7 +162,7 @@ def rag_with_memory_prompt_cn():
     ------------
     只需输出精炼的答案。不要打印任何其他信息。
     """
-    return Template(template)
+    return _template(template)
 
 
 def memory_prompt():
@@ -126,7 +181,7 @@ def memory_prompt():
         Query: {{ query }}
         Answer:
     """
-    return Template(template)
+    return _template(template)
 
 
 def keyword_promt():
@@ -136,7 +191,7 @@ def keyword_promt():
         Query: {{ query }}
         Answer:
     """
-    return Template(template)
+    return _template(template)
 
 
 def rerank_prompt():
@@ -149,7 +204,7 @@ def rerank_prompt():
         Documents: {{ documents }}
         Extrac the answer. Do not give any explaination or other information.
     """
-    return Template(template)
+    return _template(template)
 
 
 @prompt
@@ -225,7 +280,7 @@ def get_food_nutrients_prompt(
     query="请分析这张食物图片并提供营养信息。",
 ):
     """Query: {{ query }}.  meal_type: {{ meal_type }} \n
-    {% if false(is_userinfo) %}
+    {% if not is_userinfo %}
     User did not provide any information.
     {% endif %}
     Tools: \n
@@ -636,6 +691,10 @@ def emma_format_chat(query, content):
     3. When translate the response, you should keep the content, the meaning, the writing style of the response, and be aware to make the translation sounds comfort, cherish and concerning. This is very important to the user \n
     4. If the response fulfills the requirements, you should output the response. \n
     5. ONLY output the response. \n
+
+    User's query: {{ query }} \n
+    The response: \n
+    {{ content }}
     """
 
 
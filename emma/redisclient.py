@@ -0,0 +1,42 @@
+"""
+Shared asyncio Redis client. Every caller borrows connections from one pool
+instead of opening a new connection per request.
+"""
+
+from typing import TYPE_CHECKING
+
+from .settings import settings
+
+if TYPE_CHECKING:
+    import redis.asyncio
+
+REDIS_URL = settings.redis_url
+REDIS_MAX_CONNECTIONS = settings.redis_max_connections
+
+_client = None
+
+
+def redis_client() -> "redis.asyncio.Redis":
+    """Return the process-wide client, creating its pool on first use."""
+    global _client
+    if _client is None:
+        import redis.asyncio
+
+        pool = redis.asyncio.ConnectionPool.from_url(
+            REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS
+        )
+        _client = redis.asyncio.Redis(connection_pool=pool)
+    return _client
+
+
+def set_redis_client(client: "redis.asyncio.Redis") -> None:
+    """Replace the shared client, e.g. with an in-memory fake."""
+    global _client
+    _client = client
+
+
+async def close_redis_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,124 @@
+"""
+Configuration of the Emma modules, read once from the environment (and .env).
+Every field is set by the upper-case environment variable of the same name,
+e.g. DB_MAX_CONNECTIONS=40 sets `settings.db_max_connections`.
+"""
+
+import dataclasses
+import os
+import typing
+from functools import lru_cache
+from typing import Mapping, Optional
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    # LLM
+    model: Optional[str] = None
+    # Answer "#test%" queries with the canned test/test_resp.txt, never in production
+    enable_test_queries: bool = False
+    format_min_chars: int = 200
+    format_concurrency: int = 3
+    prompt_cache_dir: Optional[str] = None
+
+    # Postgres
+    db_name: Optional[str] = None
+    db_user: Optional[str] = None
+    db_password: Optional[str] = None
+    db_host: str = "localhost"
+    db_port: int = 19032
+    db_max_connections: int = 20
+    db_stale_timeout: int = 300
+    db_pool_timeout: int = 10
+    db_health_check_interval: float = 30
+    db_executor_workers: int = 8
+
+    # Redis
+    redis_url: str = "redis://localhost:6379/0"
+    redis_max_connections: int = 50
+    event_id_block: int = 1000
+
+    # Bloom backend
+    bloom_key: Optional[str] = None
+    bloom_api_url: str = "http://localhost:8000/api/v1"
+    bloom_max_connections: int = 100
+    bloom_max_keepalive: int = 20
+    bloom_keepalive_expiry: float = 30
+    bloom_timeout: float = 10
+
+    # Embeddings, semantic cache and intent routing
+    embedding_url: str = "https://api.openai.com/v1"
+    embedding_key: Optional[str] = None
+    openai_key: Optional[str] = None
+    embedding_model: str = "text-embedding-3-large"
+    embedding_dim: int = 1792
+    semantic_cache_threshold: float = 0.95
+    intent_keyword_rules: bool = False
+    intent_keyword_min_hits: int = 2
+    intent_keyword_margin: int = 2
+    intent_embedding_threshold: float = 0.6
+    intent_embedding_margin: float = 0.08
+    intent_centroids: Optional[str] = None
+
+    # Conversation history
+    history_window: int = 20
+    history_window_ttl: float = 3600
+    history_cache: str = "redis"
+    history_page_size: int = 50
+
+    # Nutrition
+    profile_cache_size: int = 10000
+    profile_cache_ttl: float = 600
+    profile_update_channel: str = "emma:profile_updated"
+    meal_photo_cache_size: int = 2000
+    meal_photo_cache_ttl: float = 86400
+    meal_photo_max_distance: int = 6
+    nutrient_batch_concurrency: int = 4
+    vision_max_side: int = 1280
+    vision_jpeg_quality: int = 85
+
+    # Logging and metrics
+    log_dir: Optional[str] = None
+    log_level: str = "INFO"
+    log_rotate_when: Optional[str] = None
+    log_max_bytes: int = 50 * 2**20
+    log_backup_count: int = 10
+    metrics_dump_interval: float = 60
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "Settings":
+        hints = typing.get_type_hints(cls)
+        values = {}
+        for field in dataclasses.fields(cls):
+            raw = environ.get(field.name.upper())
+            if raw is None or raw == "":
+                continue
+            values[field.name] = _convert(raw, hints[field.name])
+        settings = cls(**values)
+        if settings.embedding_key is None:
+            settings = dataclasses.replace(settings, embedding_key=settings.openai_key)
+        return settings
+
+
+def _convert(raw: str, kind):
+    if typing.get_origin(kind) is typing.Union:
+        kind = next(arg for arg in typing.get_args(kind) if arg is not type(None))
+    if kind is bool:
+        return raw.strip().lower() in ("1", "true", "yes", "on")
+    return kind(raw)
+
+
+@lru_cache(maxsize=1)
+def load_settings() -> Settings:
+    """Read .env (when python-dotenv is installed) and the environment, once"""
+    try:
+        import dotenv
+    except ImportError:
+        pass
+    else:
+        dotenv.load_dotenv()
+    return Settings.from_env()
+
+
+settings = load_settings()
+
@@ -1,5 +1,5 @@
 # Description: Utility functions for the project
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import re
 import orjson as json
 
@@ -9,24 +9,249 @@ def make_table_name(model_class):
     return 'emma_' + model_name.lower()
     
     
+def chunk_content(chunk) -> str:
+    """Text of a chat completion chunk, streamed (delta) or complete (message)"""
+    choice = chunk.choices[0]
+    message = getattr(choice, "delta", None) or getattr(choice, "message", None)
+    return (message.content if message else None) or ""
+
+
+def set_chunk_content(chunk, content: str) -> None:
+    choice = chunk.choices[0]
+    message = getattr(choice, "delta", None) or getattr(choice, "message", None)
+    message.content = content
+
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_LATIN = re.compile(r"[A-Za-z]")
+
+
+def detect_language(text: str, min_letters: int = 1) -> Optional[str]:
+    """
+    "zh" or "en" by the share of CJK characters among the letters of the text,
+    None when it has fewer than `min_letters` letters.
+    """
+    cjk = len(_CJK.findall(text))
+    latin = len(_LATIN.findall(text))
+    # an English word carries ~5 letters for one Chinese character
+    if cjk + latin < min_letters:
+        return None
+    return "zh" if cjk * 5 >= latin else "en"
+
+
+_STRUCTURAL = re.compile(r'[{}"]')
+# a brace followed by a key or "}" opens an object, "{注意}" in prose does not
+_OBJECT_START = re.compile(r'\{\s*["}]')
+
+
+def _string_end(text: str, i: int, end: int) -> int:
+    """Offset of the quote closing the JSON string opened at text[i - 1], or -1"""
+    while True:
+        i = text.find('"', i, end)
+        if i == -1:
+            return -1
+        backslashes = 0
+        while text[i - 1 - backslashes] == "\\":
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return i
+        i += 1
+
+
+def iter_json_spans(
+    text: str, start: int = 0, end: Optional[int] = None
+) -> Iterator[Tuple[int, int]]:
+    """
+    Yield the (start, end) offsets of every balanced top-level {...} in
+    text[start:end], in one linear pass. Braces inside JSON strings are
+    ignored. The offsets of open braces are kept on a stack; a span closed
+    while an outer brace is still open is held back and yielded at the end of
+    the text only if that outer brace never closes.
+    """
+    end = len(text) if end is None else end
+    openers: List[int] = []
+    # closed spans inside a brace that is still open
+    nested: List[Tuple[int, int]] = []
+    i = start
+    while True:
+        if not openers:
+            match = _OBJECT_START.search(text, i, end)
+            if not match:
+                return
+            openers.append(match.start())
+            i = match.start() + 1
+            continue
+        match = _STRUCTURAL.search(text, i, end)
+        if not match:
+            break
+        i = match.start()
+        char = text[i]
+        if char == '"':
+            i = _string_end(text, i + 1, end)
+            if i == -1:
+                break
+            i += 1
+            continue
+        i += 1
+        if char == "{":
+            openers.append(i - 1)
+            continue
+        opened = openers.pop()
+        if not openers:
+            nested.clear()
+            yield opened, i
+            continue
+        while nested and nested[-1][0] > opened:
+            nested.pop()
+        nested.append((opened, i))
+    # the text ended inside an unclosed brace: treat it as prose
+    yield from nested
+
+
+def _fenced_block(text: str) -> Optional[Tuple[int, int]]:
+    """Offsets of the body of the first ```json fenced block"""
+    fence = text.find("```json")
+    if fence == -1:
+        return None
+    body = fence + len("```json")
+    close = text.find("```", body)
+    return body, len(text) if close == -1 else close
+
+
+def extract_all_json_from_text(text: str) -> List[Dict[str, Any]]:
+    """Every JSON object in the text, in order; spans that fail to parse are skipped"""
+    objects = []
+    for start, end in iter_json_spans(text):
+        try:
+            objects.append(json.loads(text[start:end]))
+        except json.JSONDecodeError:
+            continue
+    return objects
+
+
 def extract_json_from_text(text: str) -> Dict[str, Any]:
     """
     Extract JSON from text response, handling cases where JSON might be within markdown code blocks
-    or mixed with other text
-    """
-    # Try to find JSON block in markdown
-    json_match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
-    if json_match:
-        json_str = json_match.group(1)
-    else:
-        # Try to find any JSON-like structure
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-        else:
-            raise ValueError("No JSON found in response")
-    
-    try:
-        return json.loads(json_str)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Failed to parse JSON: {str(e)}")
\ No newline at end of file
+    or mixed with other text. Returns the first complete object, preferring a ```json block.
+    """
+    regions = [(0, len(text))]
+    fenced = _fenced_block(text)
+    if fenced:
+        regions.insert(0, fenced)
+
+    error = None
+    for region in regions:
+        for start, end in iter_json_spans(text, *region):
+            try:
+                return json.loads(text[start:end])
+            except json.JSONDecodeError as e:
+                error = e
+    if error is None:
+        raise ValueError("No JSON found in response")
+    raise ValueError(f"Failed to parse JSON: {str(error)}")
+
+
+class JsonFieldStreamer:
+    """
+    Incrementally decode one string field of a JSON object from streamed text,
+    e.g. the `message` of ```json {"message": "..."}```.
+    Text before the field (prose, code fences, other keys) is skipped and the
+    decoded value is returned piece by piece as the chunks arrive.
+    """
+
+    _ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+    _SPECIAL = re.compile(r'["\\]')
+
+    def __init__(self, field: str = "message"):
+        self.field = field
+        self.found = False
+        self.done = False
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._raw = []
+        self._pending = ""
+
+    @property
+    def text(self) -> str:
+        return "".join(self._raw)
+
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk and return the newly decoded part of the field"""
+        self._raw.append(chunk)
+        if self.done:
+            return ""
+        self._pending += chunk
+        if not self.found:
+            match = self._key.search(self._pending)
+            if not match:
+                # keep enough to match a key split across chunks
+                self._pending = self._pending[-(len(self.field) + 64):]
+                return ""
+            self.found = True
+            self._pending = self._pending[match.end():]
+        return self._decode()
+
+    def finish(self) -> str:
+        """
+        Return what is left once the stream ends. When the field never appeared,
+        fall back to parsing the whole text, or the text itself if it is not JSON.
+        """
+        if self.found:
+            return ""
+        text = self.text
+        try:
+            return str(extract_json_from_text(text)[self.field])
+        except (ValueError, KeyError, TypeError):
+            return text.strip()
+
+    def _decode(self) -> str:
+        s = self._pending
+        n = len(s)
+        out = []
+        i = 0
+        while i < n:
+            match = self._SPECIAL.search(s, i)
+            if not match:
+                out.append(s[i:])
+                i = n
+                break
+            j = match.start()
+            out.append(s[i:j])
+            if s[j] == '"':
+                self.done = True
+                i = n
+                break
+            # escape sequence, wait for the rest of it if it is split
+            if j + 1 >= n:
+                i = j
+                break
+            c = s[j + 1]
+            if c != "u":
+                out.append(self._ESCAPES.get(c, c))
+                i = j + 2
+                continue
+            if j + 6 > n:
+                i = j
+                break
+            try:
+                code = int(s[j + 2 : j + 6], 16)
+            except ValueError:
+                out.append(s[j : j + 6])
+                i = j + 6
+                continue
+            if 0xD800 <= code < 0xDC00:
+                if j + 12 > n:
+                    i = j
+                    break
+                try:
+                    low = int(s[j + 8 : j + 12], 16) if s[j + 6 : j + 8] == "\\u" else 0
+                except ValueError:
+                    low = 0
+                if 0xDC00 <= low < 0xE000:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i = j + 12
+                    continue
+                code = 0xFFFD
+            out.append(chr(code))
+            i = j + 6
+        self._pending = s[i:]
+        return "".join(out)
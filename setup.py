@@ -6,7 +6,13 @@ setup(
     packages=find_packages(),
     install_requires=[
         "capybara>=0.1.0",
+        # chunk types of replayed cached answers
+        "openai>=1.0",
     ],
+    extras_require={
+        # decoding meal photos: downsizing before vision calls, near-duplicate cache lookups
+        "image": ["Pillow>=10.0"],
+    },
     author="Your Name",
     author_email="your.email@example.com",
     description="A short description of your capybara project",
@@ -0,0 +1,61 @@
+import importlib
+import sys
+import types
+from types import SimpleNamespace
+
+import pytest
+
+
+def make_chunk(content, finish_reason=None):
+    """A streamed chat completion chunk, as the LLM client yields them"""
+    return SimpleNamespace(
+        id="chatcmpl-test",
+        choices=[
+            SimpleNamespace(
+                index=0,
+                delta=SimpleNamespace(role="assistant", content=content),
+                message=None,
+                finish_reason=finish_reason,
+            )
+        ],
+    )
+
+
+async def stream_chunks(*pieces, finish_reason="stop"):
+    for piece in pieces:
+        yield make_chunk(piece)
+    if finish_reason:
+        yield make_chunk(None, finish_reason)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """
+    emma.engine with the packages it imports from outside this repository
+    (agent, router, llm, nutrition) replaced by empty stand-ins; tests patch the
+    attributes they use.
+    """
+    names = {
+        "agent": {},
+        "agent.agent": {"AgentConfig": object, "ChatAgent": object, "NullAgent": object},
+        "router": {"RouterOptions": dict, "UserIntentionRouter": object},
+        "llm": {"llm": None},
+        "nutrition": {},
+        "nutrition.emma": dict.fromkeys(
+            [
+                "calculate_nutrition_per_day",
+                "get_glu_summary",
+                "get_products",
+                "get_user_info",
+                "get_user_preference_summary",
+            ]
+        ),
+    }
+    with pytest.MonkeyPatch.context() as patch:
+        for name, attrs in names.items():
+            module = types.ModuleType(name)
+            module.__dict__.update(attrs)
+            patch.setitem(sys.modules, name, module)
+        patch.delitem(sys.modules, "emma.engine", raising=False)
+        yield importlib.import_module("emma.engine")
+        sys.modules.pop("emma.engine", None)
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import pytest
+
+from emma.cache import ImageResultCache, TTLCache
+
+HASH = 0x0F0F0F0F0F0F0F0F
+
+
+def test_near_duplicate_hit_counts_one_lookup():
+    cache = ImageResultCache()
+    for i in range(3):
+        cache.set((f"sha{i}", HASH ^ (0xFF << (8 * (i + 1)))), "ctx", i, "u1")
+    cache.set(("match", HASH), "ctx", "value", "u1")
+
+    assert cache.get(("other", HASH ^ 0b11), "ctx", "u1") == "value"
+    assert cache.stats() == {
+        "size": 4,
+        "hits": 0,
+        "misses": 1,
+        "evictions": 0,
+        "near_hits": 1,
+    }
+
+
+def test_near_duplicate_needs_same_context():
+    cache = ImageResultCache()
+    cache.set(("match", HASH), "ctx", "value", "u1")
+    assert cache.get(("other", HASH ^ 0b11), "other context", "u1") is None
+    assert cache.get(("match", HASH), "ctx") == "value"
+    assert cache.stats()["hits"] == 1
+
+
+def test_near_duplicate_is_not_shared_across_users():
+    cache = ImageResultCache()
+    cache.set(("match", HASH), "ctx", "value", "u1")
+    assert cache.get(("other", HASH ^ 0b11), "ctx", "u2") is None
+    assert cache.get(("other", HASH ^ 0b11), "ctx") is None
+    assert cache.stats()["near_hits"] == 0
+    # the exact same photo is the same meal whoever sends it
+    assert cache.get(("match", HASH), "ctx", "u2") == "value"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("emma.cache.time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_ttl_cache_expires_entries(clock):
+    entries = TTLCache(maxsize=4, ttl=10)
+    entries.set("a", 1)
+    clock[0] += 9
+    assert entries.get("a") == 1
+    clock[0] += 2
+    assert entries.get("a") is None
+    assert entries.peek("a") is None
+    assert entries.stats() == {"size": 0, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    entries = TTLCache(maxsize=2, ttl=10)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+    entries.set("c", 3)
+    assert entries.keys() == ["a", "c"]
+    assert entries.stats()["evictions"] == 1
+
+
+def test_ttl_cache_peek_leaves_order_and_counters(clock):
+    entries = TTLCache(maxsize=2, ttl=10)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    assert entries.peek("a") == 1
+    entries.set("c", 3)
+    assert entries.keys() == ["b", "c"]
+    assert entries.stats()["hits"] == entries.stats()["misses"] == 0
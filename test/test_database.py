@@ -0,0 +1,66 @@
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from emma.database import HealthCheckedPooledDatabase
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        self.conn.pings += 1
+        if self.conn.pings > self.conn.healthy_pings:
+            raise ConnectionError("server closed the connection")
+
+
+class Connection:
+    """psycopg2 connection answering `healthy_pings` pings, then gone"""
+
+    def __init__(self, healthy_pings=0):
+        self.healthy_pings = healthy_pings
+        self.pings = 0
+        self.closed = 0
+        self.closes = 0
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return Cursor(self)
+
+    def close(self):
+        self.closes += 1
+        self.closed = 1
+
+
+def pool():
+    return HealthCheckedPooledDatabase("emma", health_check_interval=30)
+
+
+def test_failed_health_check_closes_the_connection():
+    db = pool()
+    # peewee's own check passes, the ping after the idle interval fails
+    conn = Connection(healthy_pings=1)
+    assert db._is_closed(conn)
+    assert conn.closes == 1
+    assert db.pool_stats()["failed_health_checks"] == 1
+
+
+def test_connection_dropped_by_peewee_is_closed():
+    conn = Connection()
+    assert pool()._is_closed(conn)
+    assert conn.closes == 1
+
+
+def test_recently_released_connection_is_not_pinged_again():
+    db = pool()
+    conn = Connection(healthy_pings=1)
+    db._close(conn)
+    assert not db._is_closed(conn)
+    assert conn.pings == 1 and conn.closes == 0
@@ -0,0 +1,58 @@
+import asyncio
+
+from conftest import stream_chunks
+
+
+def collect(stream):
+    async def run():
+        return [
+            (chunk.choices[0].delta.content, chunk.choices[0].finish_reason)
+            async for chunk in stream
+        ]
+
+    return asyncio.run(run())
+
+
+def test_stream_json_field_streams_the_message(engine):
+    chunks = stream_chunks('```json\n{"mess', 'age": "Hi ', 'there"}\n```')
+    assert collect(engine.stream_json_field(chunks)) == [
+        ("Hi ", None),
+        ("there", None),
+        (None, "stop"),
+    ]
+
+
+def test_stream_json_field_sends_plain_text_before_the_finish_chunk(engine):
+    chunks = stream_chunks("Sorry, ", "plain text answer")
+    assert collect(engine.stream_json_field(chunks)) == [
+        ("Sorry, plain text answer", None),
+        (None, "stop"),
+    ]
+
+
+def test_rewrite_paragraphs_keeps_order_and_ends_once(engine, monkeypatch):
+    prompts = []
+
+    async def llm(prompt, model=None, stream=False):
+        paragraph = prompt.rsplit("The response:", 1)[1].strip()
+        prompts.append(paragraph)
+        # later paragraphs finish first
+        delay = 0.01 * (3 - len(prompts))
+
+        async def rewrite():
+            await asyncio.sleep(delay)
+            async for chunk in stream_chunks("", paragraph.upper()):
+                yield chunk
+
+        return rewrite()
+
+    monkeypatch.setattr(engine, "llm", llm)
+    monkeypatch.setattr(engine, "FORMAT_MIN_CHARS", 5)
+    chunks = stream_chunks("first line\n", "second line\n\n", "third")
+    assert collect(engine.rewrite_paragraphs("question", chunks)) == [
+        ("FIRST LINE", None),
+        ("\nSECOND LINE", None),
+        ("\n\nTHIRD", None),
+        (None, "stop"),
+    ]
+    assert prompts == ["first line", "second line", "third"]
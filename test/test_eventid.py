@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from emma.eventid import EventIdAllocator
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+async def allocate(client, count, block):
+    allocator = EventIdAllocator(block=block, client=client)
+    return [await allocator.next_id() for _ in range(count)]
+
+
+def test_ids_are_unique_across_workers():
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        await client.set("fp", "abc")
+        # a caller still using INCR in between
+        await client.incr("event_num")
+        ids = await asyncio.gather(*(allocate(client, 7, 3) for _ in range(4)))
+        return ids, int(await client.get("event_num"))
+
+    ids, counter = asyncio.run(run())
+    flat = [event_id for worker in ids for event_id in worker]
+    assert len(set(flat)) == len(flat) == 28
+    assert all(event_id.startswith("chatcmpl-abc-") for event_id in flat)
+    numbers = sorted(int(event_id.rsplit("-", 1)[1]) for event_id in flat)
+    assert numbers[0] > 1 and numbers[-1] <= counter
+
+
+def test_concurrent_requests_reserve_one_block():
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        await client.set("fp", "abc")
+        allocator = EventIdAllocator(block=10, client=client)
+        numbers = await asyncio.gather(*(allocator.next_number() for _ in range(10)))
+        return numbers, int(await client.get("event_num"))
+
+    numbers, counter = asyncio.run(run())
+    assert sorted(numbers) == list(range(1, 11))
+    assert counter == 10
+
+
+def test_missing_fingerprint_raises():
+    allocator = EventIdAllocator(block=5, client=fakeredis.FakeAsyncRedis())
+    with pytest.raises(RuntimeError):
+        asyncio.run(allocator.next_id())
@@ -0,0 +1,58 @@
+import base64
+import io
+import random
+import sys
+
+import pytest
+
+from emma.health.image import (
+    data_url,
+    decode_data_url,
+    prepare_image,
+    prepare_image_url,
+    sniff_mime,
+)
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def encode(image, fmt, **params):
+    output = io.BytesIO()
+    image.save(output, fmt, **params)
+    return output.getvalue()
+
+
+@pytest.fixture
+def small_png():
+    # flat and tiny: re-encoding as JPEG does not make it smaller
+    return encode(Image.new("RGB", (2, 2), (200, 30, 30)), "PNG")
+
+
+def test_png_data_url_keeps_its_mime(small_png):
+    url = prepare_image_url(data_url(small_png, "image/png"))
+    assert url.startswith("data:image/png;base64,")
+    assert decode_data_url(url) == (small_png, "image/png")
+
+
+def test_pass_through_without_pillow(small_png, monkeypatch):
+    monkeypatch.setitem(sys.modules, "PIL", None)
+    assert prepare_image(small_png) == (small_png, "image/png")
+
+
+def test_undecodable_data_keeps_the_given_mime():
+    data = b"\x89PNG\r\n\x1a\n truncated"
+    assert prepare_image(data) == (data, "image/png")
+    assert prepare_image(b"???", mime="image/webp") == (b"???", "image/webp")
+
+
+def test_large_png_is_reencoded_as_jpeg():
+    pixels = random.Random(0).randbytes(1600 * 1200 * 3)
+    noise = Image.frombytes("RGB", (1600, 1200), pixels)
+    data, mime = prepare_image(encode(noise, "PNG"), max_side=800)
+    assert mime == "image/jpeg" and sniff_mime(data) == "image/jpeg"
+    assert max(Image.open(io.BytesIO(data)).size) == 800
+
+
+def test_data_url_without_mime_is_sniffed(small_png):
+    url = "data:;base64," + base64.b64encode(small_png).decode()
+    assert decode_data_url(url)[1] == "image/png"
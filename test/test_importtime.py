@@ -0,0 +1,40 @@
+import pytest
+
+from benchmarks.importtime import profile, subtree
+
+# Milliseconds per module, several times what a warm import takes on a laptop.
+# emma.engine and emma.health.nutrient need packages outside this repository.
+BUDGETS = {
+    "emma.cache": 100,
+    "emma.utils": 150,
+    "emma.prompt": 200,
+    "emma.health.image": 200,
+    "emma.memory": 600,
+    "emma.history": 600,
+}
+# Imported on first use, never by importing an Emma module
+LAZY = {"httpx", "redis", "jinja2", "openai", "PIL"}
+
+
+def fastest(module):
+    """Subtree of the fastest of three imports; the first also writes bytecode"""
+    runs = []
+    for _ in range(3):
+        entries, error = profile(module)
+        assert not error, error
+        runs.append(subtree(module, entries))
+    return min(runs, key=lambda entries: entries[-1].cumulative_us)
+
+
+@pytest.mark.parametrize("module, budget", sorted(BUDGETS.items()))
+def test_import_budget(module, budget):
+    entries = fastest(module)
+    assert entries[-1].cumulative_us <= budget * 1000
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_heavy_dependencies_are_lazy(module):
+    entries, error = profile(module)
+    assert not error, error
+    imported = {entry.module.split(".")[0] for entry in subtree(module, entries)}
+    assert not imported & LAZY
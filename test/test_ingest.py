@@ -0,0 +1,62 @@
+import struct
+
+import orjson
+
+from emma.ingest import COPY_HEADER, COPY_TRAILER, chunk_text, encode_copy_rows
+
+
+def read_field(data, offset):
+    (length,) = struct.unpack_from(">i", data, offset)
+    offset += 4
+    return data[offset : offset + length], offset + length
+
+
+def decode_copy_rows(data):
+    """Rows of a COPY ... BINARY stream with the columns of encode_copy_rows"""
+    assert data.startswith(COPY_HEADER) and data.endswith(COPY_TRAILER)
+    offset = len(COPY_HEADER)
+    rows = []
+    while offset < len(data) - len(COPY_TRAILER):
+        (fields,) = struct.unpack_from(">h", data, offset)
+        assert fields == 5
+        offset += 2
+        doc_id, offset = read_field(data, offset)
+        text, offset = read_field(data, offset)
+        vector, offset = read_field(data, offset)
+        organization, offset = read_field(data, offset)
+        meta, offset = read_field(data, offset)
+        dim, unused = struct.unpack_from(">hh", vector)
+        assert unused == 0 and len(vector) == 4 + 4 * dim
+        assert meta[:1] == b"\x01"
+        rows.append(
+            (
+                doc_id.decode(),
+                text.decode(),
+                list(struct.unpack_from(f">{dim}f", vector, 4)),
+                organization.decode(),
+                orjson.loads(meta[1:]),
+            )
+        )
+    return rows
+
+
+def test_encode_copy_rows_round_trip():
+    rows = [
+        ("doc-1", "孕期饮食 chunk", [0.5, -1.25, 3.0], "bloom", {"chunk": 0}),
+        ("doc-2", "", [0.0], "bloom", {"path": None, "chunk": 1}),
+    ]
+    assert decode_copy_rows(encode_copy_rows(rows).getvalue()) == rows
+
+
+def test_encode_copy_rows_empty():
+    assert encode_copy_rows([]).getvalue() == COPY_HEADER + COPY_TRAILER
+
+
+def test_chunk_text_overlaps_and_prefers_newlines():
+    text = "\n".join(f"line {i:03d} " + "x" * 40 for i in range(60))
+    chunks = chunk_text(text, size=400, overlap=50)
+    assert all(len(chunk) <= 400 for chunk in chunks)
+    assert all(chunk.endswith("x" * 40) for chunk in chunks)
+    # consecutive chunks share text, and together they cover every line
+    assert all(a[-20:] in b for a, b in zip(chunks, chunks[1:]))
+    assert all(f"line {i:03d}" in "".join(chunks) for i in range(60))
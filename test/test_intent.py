@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from emma.intent import INTENT_KEYWORDS, LocalIntentRouter, keyword_pattern
+
+
+@pytest.fixture
+def router():
+    return LocalIntentRouter(keywords=INTENT_KEYWORDS)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "a trip to Spain",
+        "Is painting the nursery safe",
+        "我老公说孕期不能吃螃蟹",
+        "Can I have coffee? I feel tired",
+        # one hit is not enough
+        "I have pain",
+        # a tie between intents goes to the LLM router
+        "I'm worried about my protein intake",
+    ],
+)
+def test_unclear_queries_fall_back(router, query):
+    assert router.keyword_choice(query) is None
+    assert asyncio.run(router.classify(query)) is None
+
+
+@pytest.mark.parametrize(
+    "query, choice",
+    [
+        ("I have a fever and some bleeding", 3),
+        ("孕期运动可以做瑜伽和游泳吗", 4),
+        ("How many calories and how much protein in an egg?", 2),
+    ],
+)
+def test_clear_queries_are_routed(router, query, choice):
+    assert asyncio.run(router.classify(query)) == {"choice": choice, "source": "keyword"}
+
+
+def test_latin_keywords_match_whole_words():
+    pattern = keyword_pattern("pain")
+    assert pattern.search("back pain")
+    assert pattern.search("pains")
+    assert pattern.search("腰pain")
+    assert not pattern.search("spain")
+    assert not pattern.search("painting")
+
+
+def test_remembered_decisions_are_reused():
+    router = LocalIntentRouter(keywords=None)
+    router.remember("今天过得怎么样呢", {"choice": "5"})
+    assert asyncio.run(router.classify("今天过得怎么样呢？")) == {
+        "choice": 5,
+        "source": "cache",
+    }
+    router.remember("好的", {"choice": "5"})
+    assert asyncio.run(router.classify("好的")) is None
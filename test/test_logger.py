@@ -0,0 +1,26 @@
+import logging
+
+import orjson
+
+from emma import logger as log
+
+
+def test_perf_records_ignore_the_log_level(monkeypatch, tmp_path):
+    records = tmp_path / "perf.jsonl"
+    handler = logging.FileHandler(records, encoding="utf-8")
+    handler.setFormatter(log.JsonLinesFormatter())
+    monkeypatch.setattr(log.listener, "handlers", (handler,))
+    monkeypatch.setattr(log.logger, "level", logging.WARNING)
+
+    log.log_perf("route", 0.0125, "chatcmpl-1", source="keyword")
+    log.logger.info("dropped below WARNING")
+    log.listener.stop()
+    log.listener.start()
+    handler.close()
+
+    lines = records.read_text().splitlines()
+    assert len(lines) == 1
+    record = orjson.loads(lines[0])
+    assert record["stage"] == "route"
+    assert record["duration_ms"] == 12.5
+    assert record["source"] == "keyword"
@@ -0,0 +1,23 @@
+import pytest
+
+from emma.prompt import get_food_nutrients_prompt
+
+GUIDELINES = {"calories": 2100.0, "protein": 75.0}
+NO_PROFILE = "User did not provide any information."
+
+
+@pytest.mark.parametrize("is_userinfo, mentions_missing", [(True, False), (False, True)])
+def test_food_nutrients_prompt_with_and_without_profile(is_userinfo, mentions_missing):
+    prompt = get_food_nutrients_prompt(
+        meal_type=2, guidelines=GUIDELINES, products="", is_userinfo=is_userinfo
+    )
+    assert (NO_PROFILE in prompt) == mentions_missing
+    assert "2100.0 calories" in prompt
+    assert "meal_type: 2" in prompt
+
+
+
+def test_food_nutrients_prompt_renders_defaults():
+    prompt = get_food_nutrients_prompt(1, GUIDELINES, "")
+    assert NO_PROFILE not in prompt
+    assert prompt.startswith("Query: 请分析这张食物图片并提供营养信息。.")
@@ -0,0 +1,99 @@
+import datetime
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from emma.database import db
+from emma.health import rollup
+from emma.health.db import MealData, UserNutrition
+
+pgserver = pytest.importorskip("pgserver")
+
+DAY = datetime.datetime(2026, 3, 2, 12, 0)
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    """The shared pool pointed at a throwaway Postgres with the rollup trigger"""
+    server = pgserver.get_server(
+        str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop"
+    )
+    uri = urlparse(server.get_uri())
+    database, params = db.database, dict(db.connect_params)
+    db.init(
+        uri.path.lstrip("/"),
+        user=uri.username,
+        password=None,
+        host=parse_qs(uri.query)["host"][0],
+        port=uri.port or 5432,
+    )
+    db.create_tables([MealData, UserNutrition])
+    rollup.install_trigger()
+    yield db
+    db.close_all()
+    db.init(database, **params)
+    server.cleanup()
+
+
+@pytest.fixture
+def meals(database):
+    yield
+    MealData.delete().execute()
+    UserNutrition.delete().execute()
+
+
+def nutrient(calories, protein=1.0):
+    return {
+        "macro": {"calories": calories, "protein": protein, "fat": 0, "carb": 0},
+        "micro": {"fa": 0, "vc": 0, "vd": 0},
+        "mineral": {"calcium": 0, "iron": 0, "zinc": 0, "iodine": 0},
+    }
+
+
+def meal(calories, created_at=DAY, **nutrients):
+    return MealData.create(
+        userid="u1",
+        type=1,
+        food={},
+        nutrient={**nutrient(calories), **nutrients},
+        created_at=created_at,
+    )
+
+
+def totals(day=DAY):
+    rows = rollup.read_nutrition_per_day("u1", day, day)
+    return rows[0][1:3] if rows else None
+
+
+def test_trigger_follows_inserts_updates_and_deletes(meals):
+    first = meal(500)
+    meal(250)
+    assert totals() == (750.0, 2.0)
+
+    MealData.update(nutrient=nutrient(100)).where(MealData.id == first.id).execute()
+    assert totals() == (350.0, 2.0)
+
+    next_day = DAY + datetime.timedelta(days=1)
+    MealData.update(created_at=next_day).where(MealData.id == first.id).execute()
+    assert totals() == (250.0, 1.0)
+    assert totals(next_day) == (100.0, 1.0)
+
+    MealData.delete().where(MealData.id == first.id).execute()
+    assert totals(next_day) == (0.0, 0.0)
+    assert rollup.check("u1", days=365 * 5) == []
+
+
+def test_non_numeric_values_do_not_block_the_meal(meals):
+    meal("12g", macro={"calories": "unknown", "protein": 3.5, "fat": None})
+    meal(200)
+    assert MealData.select().count() == 2
+    assert totals() == (200.0, 4.5)
+    assert rollup.check("u1", days=365 * 5) == []
+
+
+def test_backfill_rebuilds_rollups(meals):
+    meal(300)
+    UserNutrition.delete().execute()
+    assert rollup.check("u1", days=365 * 5)
+    assert rollup.backfill("u1", days=365 * 5) == 1
+    assert totals() == (300.0, 1.0)
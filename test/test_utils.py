@@ -0,0 +1,87 @@
+import time
+
+import orjson
+import pytest
+
+from emma.utils import (
+    JsonFieldStreamer,
+    extract_all_json_from_text,
+    extract_json_from_text,
+    iter_json_spans,
+)
+
+
+def spans(text):
+    return [text[start:end] for start, end in iter_json_spans(text)]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('a {"x": 1} b {"y": {"z": 2}}', ['{"x": 1}', '{"y": {"z": 2}}']),
+        # braces and escaped quotes inside strings
+        ('{"s": "q\\"} {"} x', ['{"s": "q\\"} {"}']),
+        # braces in prose are not objects
+        ('{注意} {"a": 2}', ['{"a": 2}']),
+        ('{"a": 1', []),
+        # objects inside a brace that never closes
+        ('{"a": {"b": 1}, {"c": 2}', ['{"b": 1}', '{"c": 2}']),
+    ],
+)
+def test_iter_json_spans(text, expected):
+    assert spans(text) == expected
+
+
+def test_iter_json_spans_region():
+    text = '{"a": 1} ```json {"b": 2} ```'
+    assert spans(text) == ['{"a": 1}', '{"b": 2}']
+    assert list(iter_json_spans(text, 12)) == [(17, 25)]
+
+
+def test_unclosed_openers_take_linear_time():
+    text = '{"a":' * 4000 + '{"ok": 1}'
+    started = time.perf_counter()
+    assert extract_all_json_from_text(text) == [{"ok": 1}]
+    assert time.perf_counter() - started < 1.0
+
+
+def test_extract_json_prefers_fenced_block():
+    text = 'see {"a": 1}\n```json\n{"b": 2}\n```'
+    assert extract_json_from_text(text) == {"b": 2}
+    with pytest.raises(ValueError):
+        extract_json_from_text("no json here")
+
+
+def stream(text, size, field="message"):
+    streamer = JsonFieldStreamer(field)
+    pieces = [streamer.feed(text[i : i + size]) for i in range(0, len(text), size)]
+    return "".join(pieces) + streamer.finish()
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_json_field_streamer_decodes_split_chunks(size):
+    value = 'line "one"\n\ttab \\ slash 孕期 😀'
+    text = "Sure:\n```json\n" + orjson.dumps({"id": 1, "message": value}).decode()
+    text += "\n```"
+    assert stream(text, size) == value
+    # escapes written by other encoders, split anywhere
+    assert stream('{"message": "a\\u00e9\\ud83d\\ude00\\/b"}', size) == "aé😀/b"
+
+
+def test_json_field_streamer_stops_at_closing_quote():
+    streamer = JsonFieldStreamer()
+    assert streamer.feed('{"message": "hi"') == "hi"
+    assert streamer.done
+    assert streamer.feed(', "message": "again"}') == ""
+    assert streamer.finish() == ""
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("plain answer without json ", "plain answer without json"),
+        ('{"message": 42}', "42"),
+    ],
+)
+def test_json_field_streamer_falls_back_when_field_is_missing(text, expected):
+    assert stream(text, 4) == expected